@@ -1,25 +1,24 @@
 import os
-import requests
+from functools import lru_cache
 
 from dotenv import load_dotenv
-from twilio.rest import Client
 
 # Load Credentials from .env
 load_dotenv()
 
 twilio_account_sid = os.getenv('TWILIO_ACCOUNT_SID')
 twilio_auth_token = os.getenv('TWILIO_AUTH_TOKEN')
-TWILIO_CLIENT = Client(twilio_account_sid, twilio_auth_token)
 
-# Init Return-Zero
-rtzr_client_url = os.getenv('RETURNZERO_CLIENT_URL')
-rtzr_client_id = os.getenv('RETURNZERO_CLIENT_ID')
-rtzr_client_secret = os.getenv('RETURNZERO_CLIENT_SECRET')
-resp = requests.post(
-    rtzr_client_url,
-    data={'client_id': rtzr_client_id, 'client_secret': rtzr_client_secret}
-)
-RTZR_TOKEN = resp.json()['access_token']
+@lru_cache(maxsize=None)
+def get_twilio_client():
+    # Imported on first use; twilio.rest is slow to import and not needed to serve calls
+    from twilio.rest import Client
+    return Client(twilio_account_sid, twilio_auth_token)
+
+# Return-Zero (the token itself is fetched by RtzrTokenManager at startup)
+RTZR_CLIENT_URL = os.getenv('RETURNZERO_CLIENT_URL')
+RTZR_CLIENT_ID = os.getenv('RETURNZERO_CLIENT_ID')
+RTZR_CLIENT_SECRET = os.getenv('RETURNZERO_CLIENT_SECRET')
 
 # PostgreSQL
 HOST = os.getenv('HOST')
@@ -27,4 +26,4 @@ DATABASE = os.getenv('DATABASE')
 USER = os.getenv('USER')
 PASSWORD = os.getenv('PASSWORD')
 
-ELEVENLABS_VOICE_ID = os.getenv('ELEVENLABS_VOICE_ID')
\ No newline at end of file
+ELEVENLABS_VOICE_ID = os.getenv('ELEVENLABS_VOICE_ID')
@@ -1,68 +1,94 @@
 import asyncio
+import os
 from contextlib import asynccontextmanager
-import json
-import threading
 
-from aiohttp import ClientSession
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-import pika
 import psycopg2
 
-from . import HOST, DATABASE, USER, PASSWORD
-from app.router.router import router, transcribe
+from . import HOST, DATABASE, USER, PASSWORD, RTZR_CLIENT_URL, RTZR_CLIENT_ID, RTZR_CLIENT_SECRET
+from app.router.router import router
+from app.router.metrics import router as metrics_router
+from app.router.consumer import RabbitMQConsumer
 from app.router.container import RabbitMQContainer
-
-# 전역 이벤트 루프 변수
-global_event_loop = None
-
-def get_or_create_event_loop():
-    global global_event_loop
-    if global_event_loop is None:
-        global_event_loop = asyncio.get_event_loop()  # 현재 이벤트 루프 가져오기
-        print(f"Created a new event loop with ID: {id(global_event_loop)}")
-    else:
-        print(f"Using existing event loop with ID: {id(global_event_loop)}")
-    return global_event_loop
+from app.service.archive import ARCHIVE_ENABLED, CallArchiver
+from app.service.auth import RtzrTokenManager
+from app.service.call_state import CALL_STATE_BACKEND, create_call_state
+from app.service.db import create_db_pool, ModelUpdateBatcher
+from app.service.loop_monitor import LOOP_MONITOR_ENABLED, LoopMonitor
+from app.service.playback import PLAYBACK_MODE
+from app.service.rtzr_pool import RtzrConnectionPool
+from app.service.session import CallSessionRegistry
+from app.service.tts_cache import TTS_CACHE_ENABLED, TTSCache
+from app.service.tts_prefetch import create_tts_prefetcher
+from app.service.upstream import create_stream_session, create_upstream_session, warm_upstream_connections
+
+# RabbitMQ 소비자 실행 위치: 'embedded'는 API 워커마다 하나씩, 'external'은 별도 프로세스 (python -m app.worker)
+RABBITMQ_CONSUMER_MODE = os.getenv('RABBITMQ_CONSUMER_MODE', 'embedded')
+RABBITMQ_CONSUMER_EMBEDDED = RABBITMQ_CONSUMER_MODE == 'embedded'
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global global_event_loop
-    app.state.session = ClientSession()
-    app.state.response_queues = {}
-    app.state.convos = {}
+    # 이벤트 루프 지연 측정 및 루프를 막는 코드 감지
+    app.state.loop_monitor = LoopMonitor() if LOOP_MONITOR_ENABLED else None
+    if app.state.loop_monitor is not None:
+        await app.state.loop_monitor.start()
+    app.state.session = create_upstream_session()
+    app.state.stream_session = create_stream_session()  # 통화 내내 열려 있는 STT 웹소켓 전용
+    # 벤더 연결 미리 열기 (시작을 막지 않음)
+    warm_task = asyncio.create_task(warm_upstream_connections(app.state.session))
+    app.state.calls = CallSessionRegistry()  # CallSid별 통화 상태
+    await app.state.calls.start()
+    app.state.call_state = create_call_state(app.state.calls)  # 워커 간 공유 가능한 통화 상태
+
+    app.state.rtzr_token = RtzrTokenManager(app.state.session, RTZR_CLIENT_URL, RTZR_CLIENT_ID, RTZR_CLIENT_SECRET)
+    await app.state.rtzr_token.start()
+    app.state.rtzr_pool = RtzrConnectionPool(app.state.stream_session, app.state.rtzr_token)
+    await app.state.rtzr_pool.start()
+    # 통화 음성 녹음 (백그라운드에서 묶어서 파일에 기록)
+    app.state.archiver = CallArchiver() if ARCHIVE_ENABLED else None
+    if app.state.archiver is not None:
+        await app.state.archiver.start()
+    # 자주 쓰는 문구의 TTS 음성 캐시 (디스크 목록은 스레드에서 읽음)
+    app.state.tts_cache = TTSCache() if TTS_CACHE_ENABLED else None
+    if app.state.tts_cache is not None:
+        await app.state.tts_cache.start()
+    # 답변 음성 미리 합성 (media_stream 모드와 redis 상태 공유 시에는 사용하지 않음)
+    app.state.tts_prefetch = create_tts_prefetcher(PLAYBACK_MODE, CALL_STATE_BACKEND, app.state.archiver)
+
+    if RABBITMQ_CONSUMER_EMBEDDED:
+        app.state.db_pool = await create_db_pool()
+        app.state.model_updates = ModelUpdateBatcher(app.state.db_pool)
+
+        connection = await RabbitMQContainer.connection()  # RabbitMQ 연결 가져오기
+        # 소비자 시작 (앱 이벤트 루프에서 실행)
+        app.state.rabbit_consumer = RabbitMQConsumer(connection, app.state.model_updates)
+        await app.state.rabbit_consumer.start()
 
     try:
-        connection = RabbitMQContainer.connection()  # RabbitMQ 연결 가져오기
-        app.state.rabbit_channel = connection.channel()  # 채널 생성
-
-        try:
-            app.state.rabbit_channel.queue_declare(queue='learntoservingqueue', passive=True)  # 큐가 존재하는지 확인
-            print("learntoservingqueue already exists.")
-        except pika.exceptions.ChannelClosed:
-            app.state.rabbit_channel = connection.channel()
-            app.state.rabbit_channel.queue_declare(queue='learntoservingqueue', durable=False)
-            print("learntoservingqueue created.")
-        except pika.exceptions.QueueNotFound:
-    # 큐가 존재하지 않을 경우 생성
-            app.state.rabbit_channel.queue_declare(queue='learntoservingqueue', durable=False)
-            print("learntoservingqueue created.")
-
-        # 응답 큐 생성
-
-        # 이벤트 루프 생성
-        get_or_create_event_loop()
-
-        # 소비자 스레드 시작
-        consumer_thread = threading.Thread(target=start_rabbitmq_consumer, args=(connection,))
-        consumer_thread.start()
-
         yield  # 애플리케이션이 실행되는 동안 지속
 
     finally:
+        warm_task.cancel()
+        if app.state.tts_prefetch is not None:
+            await app.state.tts_prefetch.close()
+        if app.state.tts_cache is not None:
+            await app.state.tts_cache.close()
+        if app.state.archiver is not None:
+            await app.state.archiver.close()
+        await app.state.rtzr_pool.close()
+        await app.state.rtzr_token.close()
+        await app.state.call_state.close()
+        await app.state.calls.close()
+        if RABBITMQ_CONSUMER_EMBEDDED:
+            await app.state.rabbit_consumer.stop()
+            await connection.close()  # 연결 종료
+            await app.state.db_pool.close()
         await app.state.session.close()
-        connection.close()  # 연결 종료
-        
+        await app.state.stream_session.close()
+        if app.state.loop_monitor is not None:
+            await app.state.loop_monitor.close()
+
 app = FastAPI(
     title='Leaning ML Server API',
     summary='its server',
@@ -81,73 +107,7 @@ app.add_middleware(
 )
 
 app.include_router(router)
-
-def callback(ch, method, properties, body):
-    # 수신한 메시지를 바이트에서 문자열로 디코딩
-    decoded_body = body.decode('utf-8')
-    print("Received message:", decoded_body)
-    
-    # JSON 형식으로 변환
-    try:
-        message = json.loads(decoded_body)
-    except json.JSONDecodeError as e:
-        print(f"Failed to decode JSON: {e}")
-        return
-
-    # 모델 ID 추출
-    model_id = message.get('model_id')
-    voice_id = message.get('voice_id')
-
-    if model_id is not None:
-        print(f"Model ID: {model_id}")
-        loop = get_or_create_event_loop()
-        
-        try:
-            print(f"Calling transcribe for model ID: {model_id}")  # 호출 로그 추가
-            asyncio.run_coroutine_threadsafe(transcribe(model_id, None), loop) # transcribe 호출 (데이터 저장)
-            
-        except Exception as e:
-            print(f"Error while running transcribe: {e}")
-
-        # 응답을 datatolearnqueue로 전송
-        response_message = {"status": "processing", "model_id": model_id}
-
-    elif voice_id is not None:
-        print(f"Voice ID: {voice_id}")
-        loop = get_or_create_event_loop()
-        
-        try:
-            print(f"Calling transcribe for voice ID: {voice_id}")  # 호출 로그 추가
-            asyncio.run_coroutine_threadsafe(transcribe(None, voice_id), loop) # transcribe 호출 (데이터 저장)
-            
-        except Exception as e:
-            print(f"Error while running transcribe: {e}")
-
-        # 응답을 datatolearnqueue로 전송
-        response_message = {"status": "processing", "voice_id": voice_id}
-
-    else:
-        print("Neither Model ID nor Voice ID found in the message.")
-
-    app.state.rabbit_channel.basic_publish(
-        exchange='',
-        routing_key='datatolearnqueue',
-        body=json.dumps(response_message),
-    )
-    
-    print(f"Response sent to datatolearnqueue: {response_message}")
-
-def start_rabbitmq_consumer(connection):
-    print("Starting RabbitMQ consumer...")
-    try:
-        channel = connection.channel()
-        print("RabbitMQ connection established.")
-
-        channel.basic_consume(queue='learntoservingqueue', on_message_callback=callback, auto_ack=True)
-        print('Waiting for modelId messages. To exit press CTRL+C')
-        channel.start_consuming()
-    except Exception as e:
-        print(f"Error establishing RabbitMQ connection: {e}")
+app.include_router(metrics_router)
 
 # @app.middleware("http")
 # async def authentication(request: Request, call_next):
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import logging
+import os
+
+import aio_pika
+from aio_pika.abc import AbstractIncomingMessage, AbstractRobustConnection
+
+from .router import transcribe
+from ..service.db import ModelUpdateBatcher, MODEL_KEY_COLUMN
+
+REQUEST_QUEUE = 'learntoservingqueue'
+REPLY_QUEUE = 'datatolearnqueue'
+
+# Unacked messages the broker may push to this worker at once
+RABBITMQ_PREFETCH = int(os.getenv('RABBITMQ_PREFETCH', '64'))
+RABBITMQ_BATCH_SIZE = int(os.getenv('RABBITMQ_BATCH_SIZE', '32'))
+RABBITMQ_BATCH_WINDOW = float(os.getenv('RABBITMQ_BATCH_WINDOW', '0.05'))
+
+class RabbitMQConsumer:
+    """Consumes `learntoservingqueue` on the app's event loop.
+
+    Messages are collected into batches, processed concurrently, the
+    replies to `datatolearnqueue` are published together, and only then
+    are the messages acked. A crash before the ack redelivers them.
+    """
+
+    def __init__(self, connection: AbstractRobustConnection, batcher: ModelUpdateBatcher, prefetch: int = RABBITMQ_PREFETCH,
+                 batch_size: int = RABBITMQ_BATCH_SIZE, batch_window: float = RABBITMQ_BATCH_WINDOW):
+        self.connection = connection
+        self.batcher = batcher
+        self.prefetch = prefetch
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.channel = None
+        self._queue = None
+        self._consumer_tag = None
+        self._pending = asyncio.Queue()
+        self._batcher = None
+
+    async def start(self):
+        self.channel = await self.connection.channel(publisher_confirms=True)
+        await self.channel.set_qos(prefetch_count=self.prefetch)
+
+        try:
+            self._queue = await self.channel.declare_queue(REQUEST_QUEUE, passive=True)  # 큐가 존재하는지 확인
+            logging.info("learntoservingqueue already exists.")
+        except aio_pika.exceptions.ChannelNotFoundEntity:
+            # 큐가 존재하지 않을 경우 생성 (passive 실패 시 채널이 닫히므로 다시 연다)
+            self.channel = await self.connection.channel(publisher_confirms=True)
+            await self.channel.set_qos(prefetch_count=self.prefetch)
+            self._queue = await self.channel.declare_queue(REQUEST_QUEUE, durable=False)
+            logging.info("learntoservingqueue created.")
+
+        self._batcher = asyncio.create_task(self._run())
+        self._consumer_tag = await self._queue.consume(self._pending.put)
+        logging.info("Waiting for modelId messages (prefetch=%d, batch=%d)", self.prefetch, self.batch_size)
+
+    async def stop(self):
+        if self._consumer_tag is not None:
+            await self._queue.cancel(self._consumer_tag)
+        if self._batcher is not None:
+            self._batcher.cancel()
+        # Anything still unacked is redelivered by the broker once the channel closes
+        if self.channel is not None:
+            await self.channel.close()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._pending.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._pending.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._process_batch(batch)
+            except Exception as e:
+                logging.error(f"Error while processing RabbitMQ batch: {str(e)}")
+
+    async def _process_batch(self, batch: list):
+        results = await asyncio.gather(*(self._process(message) for message in batch), return_exceptions=True)
+
+        replies = [result for result in results if isinstance(result, dict)]
+        if replies:
+            try:
+                await asyncio.gather(*(
+                    self.channel.default_exchange.publish(
+                        aio_pika.Message(body=json.dumps(reply).encode('utf-8')),
+                        routing_key=REPLY_QUEUE,
+                    )
+                    for reply in replies
+                ))
+            except Exception as e:
+                logging.error(f"Failed to publish to datatolearnqueue: {str(e)}")
+                await batch[-1].nack(multiple=True, requeue=True)
+                return
+            logging.info("Sent %d responses to datatolearnqueue", len(replies))
+
+        if not any(isinstance(result, Exception) for result in results):
+            await batch[-1].ack(multiple=True)
+            return
+
+        for message, result in zip(batch, results):
+            if isinstance(result, Exception):
+                logging.error(f"Error while running transcribe: {result}")
+                # Retry once, then drop so a poison message cannot loop forever
+                await message.nack(requeue=not message.redelivered)
+            else:
+                await message.ack()
+
+    async def _process(self, message: AbstractIncomingMessage):
+        try:
+            body = json.loads(message.body.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            logging.error(f"Failed to decode JSON: {e}")
+            return None
+
+        model_id = body.get('model_id')
+        voice_id = body.get('voice_id')
+        key = body.get(MODEL_KEY_COLUMN)
+
+        if model_id is None and voice_id is None:
+            logging.warning("Neither Model ID nor Voice ID found in the message.")
+            return None
+
+        if key is None:
+            logging.warning(f"No '{MODEL_KEY_COLUMN}' in the message; skipping the model update.")
+        else:
+            if model_id is not None:
+                await transcribe(self.batcher, key, gpt_id=model_id)  # transcribe 호출 (데이터 저장)
+            else:
+                await transcribe(self.batcher, key, voice_id=voice_id)
+
+        # 응답을 datatolearnqueue로 전송
+        if model_id is not None:
+            return {"status": "processing", "model_id": model_id}
+        return {"status": "processing", "voice_id": voice_id}
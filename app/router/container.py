@@ -1,6 +1,6 @@
 # app/containers.py
 from dependency_injector import containers, providers
-import pika
+import aio_pika
 
 import os
 from dotenv import load_dotenv
@@ -14,12 +14,11 @@ RABBITMQ_PORT = os.getenv('RABBITMQ_PORT')
 class RabbitMQContainer(containers.DeclarativeContainer):
     wiring_config = containers.WiringConfiguration(packages=["api"])  # 필요한 패키지 설정
 
-    # RabbitMQ 연결을 Singleton으로 제공
-    connection = providers.Singleton(
-        pika.BlockingConnection,
-        pika.ConnectionParameters(
-            host=RABBITMQ_HOST,  # NestJS에서 사용하는 RabbitMQ 인스턴스와 동일한 호스트
-            port=RABBITMQ_PORT,
-            credentials=pika.PlainCredentials(RABBITMQ_CREDENTIAL1, RABBITMQ_CREDENTIAL2)
-        )
-    )
\ No newline at end of file
+    # RabbitMQ 연결 (앱 이벤트 루프에서 await, 끊기면 자동 재연결)
+    connection = providers.Coroutine(
+        aio_pika.connect_robust,
+        host=RABBITMQ_HOST,  # NestJS에서 사용하는 RabbitMQ 인스턴스와 동일한 호스트
+        port=int(RABBITMQ_PORT or 5672),
+        login=RABBITMQ_CREDENTIAL1,
+        password=RABBITMQ_CREDENTIAL2,
+    )
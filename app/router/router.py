@@ -1,17 +1,20 @@
 import asyncio
 import logging
-import os
-import requests
+import time
 
-from aiohttp import ClientSession
 from fastapi import APIRouter, WebSocket, Request, Response
 from fastapi.responses import StreamingResponse
 from twilio.twiml.voice_response import VoiceResponse
-import psycopg2
 
-from .. import RTZR_TOKEN, HOST, DATABASE, USER, PASSWORD, ELEVENLABS_VOICE_ID
-from ..service.tts import tts_stream_generator
-from ..service.stt import open_rtzr_ws, stream_audio_to_rtzr, handle_rtzr_messages, handle_twilio_messages
+from ..service.admission import current_call_sid
+from ..service.archive import TTS_MP3_TRACK
+from ..service.audio_buffer import AudioCoalescer, AudioQueue
+from ..service.db import ModelUpdateBatcher
+from ..service.llama import STREAMING_RESPONSE_MARKER, assistant_text
+from ..service.metrics import AudioClock, measure_audio_stream
+from ..service.playback import PLAYBACK_MODE, MediaStreamPlayer, play_responses
+from ..service.tts import elevenlabs_request, tts_stream_generator, tts_sentence_stream_generator
+from ..service.stt import RTZR_DRAIN_TIMEOUT, end_call, stream_audio_to_rtzr, handle_rtzr_messages, handle_twilio_messages
 
 #twilio
 router = APIRouter(
@@ -24,34 +27,18 @@ metadata = {
 }
 
 # @router.get('/test/postgres/')
-def transcribe(gpt_id: str = None, voice_id: str = None):
-    # PostgreSQL
-    connection = psycopg2.connect(
-        HOST,
-        DATABASE,
-        USER,
-        PASSWORD
-    )
-    cursor = connection.cursor()
-
-    try:
-        # model_id
-        if gpt_id:
-            print(f'[INFO] EXECUTE transcribe() - model_id: {gpt_id}')
-            cursor.execute("UPDATE model SET gpt_id = %s WHERE {} = %s".format())
-        # voice_id
-        if voice_id:
-            print(f'[INFO] EXECUTE transcribe() - voice_id: {voice_id}')
-            cursor.execute("UPDATE model SET voice_id = %s WHERE {} = %s".format())
-
-        connection.commit()
-
-    except Exception as e:
-        print("Error updating record:", e)
-        connection.rollback()  # 오류 시 롤백
-    finally:
-        cursor.close()
-        connection.close()
+async def transcribe(batcher: ModelUpdateBatcher, key: str, gpt_id: str = None, voice_id: str = None):
+    updates = []
+    # model_id
+    if gpt_id:
+        logging.info(f'EXECUTE transcribe() - model_id: {gpt_id}')
+        updates.append(batcher.update('gpt_id', key, gpt_id))
+    # voice_id
+    if voice_id:
+        logging.info(f'EXECUTE transcribe() - voice_id: {voice_id}')
+        updates.append(batcher.update('voice_id', key, voice_id))
+
+    await asyncio.gather(*updates)
 
 @router.post('/twiml/start', tags=['Twilio'])
 async def start(request: Request) -> Response:
@@ -60,16 +47,23 @@ async def start(request: Request) -> Response:
     call_sid = body.get('CallSid')
 
     if call_sid:
-        if call_sid not in request.app.state.response_queues:
-            request.app.state.response_queues[call_sid] = asyncio.Queue()  # 항상 큐로 초기화
+        await request.app.state.call_state.create(call_sid)  # 통화 상태 생성 (응답 큐 포함)
 
-        stream_url = f"wss://{request.url.hostname}/twilio/stream"
-        twilio_response.start().stream(url=stream_url, track='inbound_track')
-        twilio_response.say('Hello?', voice="Polly.Amy", language="en-US")
+        # Twilio opens /stream right after this response; have an STT session ready by then
+        request.app.state.rtzr_pool.prewarm()
 
-        await continue_call(request, twilio_response)
+        stream_url = f"wss://{request.url.hostname}/twilio/stream"
+        if PLAYBACK_MODE == 'media_stream':
+            # Bidirectional stream: answers are played over the websocket, so no continue loop
+            twilio_response.say('Hello?', voice="Polly.Amy", language="en-US")
+            twilio_response.connect().stream(url=stream_url)
+            # Reached once the server closes the stream
+            twilio_response.say('Thank you for calling. Goodbye!', voice="Polly.Amy", language="en-US")
+        else:
+            twilio_response.start().stream(url=stream_url, track='inbound_track')
+            twilio_response.say('Hello?', voice="Polly.Amy", language="en-US")
 
-        request.app.state.convos[call_sid] = ''
+            await continue_call(request, twilio_response)
 
     else:
         twilio_response.say('Something went wrong! Please try again later.')
@@ -79,60 +73,79 @@ async def start(request: Request) -> Response:
 @router.websocket("/stream")
 async def audio_stream_handler(websocket: WebSocket):
     await websocket.accept()
-    session: ClientSession = websocket.app.state.session  # main.py에서 생성한 세션 사용
 
     call_sid_queue = asyncio.Queue()
-    audio_queue = asyncio.Queue()
-
-    # Returnzero WebSocket 연결
-    rtzr_ws = await open_rtzr_ws(session, RTZR_TOKEN)
+    coalescer = AudioCoalescer()
+    audio_queue = AudioQueue(coalescer)
+    clock = AudioClock()
+    player = MediaStreamPlayer(websocket) if PLAYBACK_MODE == 'media_stream' else None
+    playback = None
+    call_sid = reason = None
+    stt_tasks = []
+    twilio = None
+
+    # Returnzero WebSocket 연결 (미리 열어둔 연결 사용)
+    rtzr_ws = await websocket.app.state.rtzr_pool.acquire()
     logging.info("Returnzero WebSocket opened")
 
     try:
-        tasks = [
-            asyncio.create_task(stream_audio_to_rtzr(audio_queue, rtzr_ws)),
-            asyncio.create_task(handle_rtzr_messages(call_sid_queue, rtzr_ws, websocket)),
-            asyncio.create_task(handle_twilio_messages(call_sid_queue, audio_queue, websocket)),
+        stt_tasks = [
+            asyncio.create_task(stream_audio_to_rtzr(audio_queue, rtzr_ws, coalescer, clock)),
+            asyncio.create_task(handle_rtzr_messages(call_sid_queue, rtzr_ws, websocket, clock, player)),
         ]
+        twilio = asyncio.create_task(handle_twilio_messages(call_sid_queue, audio_queue, websocket, coalescer, player))
+        playback = asyncio.create_task(play_responses(player, websocket)) if player is not None else None
 
-        await asyncio.gather(*tasks)
+        call_sid, reason = await twilio
+        # Closed before `start`: no CallSid ever reaches handle_rtzr_messages, so there is nothing to wait for
+        if call_sid is not None:
+            # Return Zero's last results, and the end marker, arrive after Twilio's `stop`
+            await asyncio.wait(stt_tasks, timeout=RTZR_DRAIN_TIMEOUT)
 
     finally:
+        tasks = stt_tasks + ([twilio] if twilio is not None else [])
+        for task in tasks:
+            task.cancel()
+        # Let handle_rtzr_messages push the end marker before the call is evicted
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if playback is not None:
+            playback.cancel()
+        audio_queue.close()
         await rtzr_ws.close()
+        if call_sid is not None and reason is not None:
+            await end_call(websocket, call_sid, reason)
 
 @router.post("/twilio/twiml/continue/{call_sid}", name="twiml_continue")
 async def twiml_continue(request: Request, call_sid: str) -> Response:
-    response_queue = request.app.state.response_queues.get(call_sid)
+    state = request.app.state.call_state
 
-    if not response_queue:
-        logging.error(f"Response queue for call_sid {call_sid} not found.")
+    if not await state.exists(call_sid):
+        logging.error(f"Call state for call_sid {call_sid} not found.")
         return Response(content="Error: Response queue not found.", media_type="text/xml")
 
     twilio_response = VoiceResponse()
 
     try:
-        next_transcript = await response_queue.get()
+        next_transcript = await state.pop_response(call_sid)
     except Exception as e:
         logging.error(f"Error getting transcript: {str(e)}")
         return Response(content="Error: Failed to retrieve transcript.", media_type="text/xml")
 
-    # Ensure the response_queue is of the correct type
-    if not isinstance(response_queue, asyncio.Queue):
-        logging.error(f"response_queue for call_sid {call_sid} is not a Queue. Got: {type(response_queue)}")
-        return Response(content="Error: Invalid response queue.", media_type="text/xml")
-
     # Handling the transcript response
     if next_transcript == 'END_TRANSCRIPT_MARKER':
         twilio_response.say('Thank you for calling. Goodbye!', voice="Polly.Amy", language="en-US")
+    elif next_transcript == STREAMING_RESPONSE_MARKER:
+        # The answer is still being generated; the stream endpoint reads it sentence by sentence
+        stream_url = f"{request.url.scheme}://{request.url.netloc}/twilio/elevenlabs/stream/{call_sid}"
+        twilio_response.play(stream_url)
+
+        return await continue_call(request, twilio_response)
     else:
-        if "Assistant:" in next_transcript:
-            assistant_response = next_transcript.split("Assistant:", 1)[1].strip()
-        else:
-            assistant_response = next_transcript.strip()
+        assistant_response = assistant_text(next_transcript)
 
         # Create a streaming URL endpoint for this transcript
         stream_url = f"{request.url.scheme}://{request.url.netloc}/twilio/elevenlabs/stream/{call_sid}"
-        request.app.state.convos[call_sid] = assistant_response
+        await state.set_transcript(call_sid, assistant_response)
         twilio_response.play(stream_url)
 
         # Call continue_call, ensure it returns a proper Response
@@ -157,25 +170,36 @@ async def continue_call(request: Request, twilio_response: VoiceResponse) -> Res
 
 @router.get('/elevenlabs/stream/{call_sid}')
 async def elevenlabs_stream_handler(call_sid: str, request: Request):
-    transcript = request.app.state.convos.get(call_sid, '')
-
-    elevenlabs_api_key = os.getenv('ELEVENLABS_API_KEY')
-
-    headers = {
-        "xi-api-key": elevenlabs_api_key,
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "text": transcript,
-        "model_id": "eleven_multilingual_v2",
-        "voice_settings": {
-            "stability": 0.1,
-            "similarity_boost": 0.3,
-            "style": 0.2,
-        }
-    }
-
-    # voice_id = 'pMsXgVXv3BLzUgSXRplE' # default 목소리
-    voice_id = ELEVENLABS_VOICE_ID
-
-    return StreamingResponse(tts_stream_generator(voice_id=voice_id, headers=headers, payload=payload), media_type="audio/mpeg")
+    started_at = time.monotonic()
+    current_call_sid.set(call_sid)
+    state = request.app.state.call_state
+    # End-to-end timing is only known when this worker also holds the call's media stream
+    call = request.app.state.calls.get(call_sid)
+    turn_started_at = call.turn_started_at if call is not None else None
+
+    prefetch = request.app.state.tts_prefetch
+    buffer = prefetch.get(call_sid) if prefetch is not None else None
+    if buffer is not None:
+        byte_range = buffer.byte_range(request.headers.get('range'))
+        if byte_range is not None:
+            start, end = byte_range
+            headers = {'Content-Range': f'bytes {start}-{end - 1}/{buffer.size}', 'Accept-Ranges': 'bytes'}
+            return StreamingResponse(prefetch.stream(call_sid, buffer, start, end), status_code=206, headers=headers, media_type="audio/mpeg")
+        # Replay what is already synthesized, then follow the live stream
+        audio = prefetch.stream(call_sid, buffer)
+        return StreamingResponse(measure_audio_stream(audio, started_at, turn_started_at), media_type="audio/mpeg")
+
+    transcript = await state.get_transcript(call_sid)
+
+    voice_id, headers, payload = elevenlabs_request(transcript)
+
+    sentences = await state.take_sentences(call_sid)
+    if sentences is not None:
+        audio = tts_sentence_stream_generator(session=request.app.state.session, voice_id=voice_id, headers=headers, payload=payload, sentences=sentences, cache=request.app.state.tts_cache)
+    else:
+        audio = tts_stream_generator(session=request.app.state.session, voice_id=voice_id, headers=headers, payload=payload, cache=request.app.state.tts_cache)
+    archiver = request.app.state.archiver
+    if archiver is not None:
+        audio = archiver.record(audio, call_sid, TTS_MP3_TRACK)
+
+    return StreamingResponse(measure_audio_stream(audio, started_at, turn_started_at), media_type="audio/mpeg")
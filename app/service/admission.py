@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from .metrics import ADMISSION_QUEUED, admission_wait, upstream_retry
+
+# Rate and concurrency limits per vendor; off by default since the right numbers depend on the vendor plan
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'false').lower() == 'true'
+OPENAI_RATE = float(os.getenv('OPENAI_RATE', '50'))  # requests per second
+OPENAI_BURST = int(os.getenv('OPENAI_BURST', '50'))
+OPENAI_CONCURRENCY = int(os.getenv('OPENAI_CONCURRENCY', '100'))
+ELEVENLABS_RATE = float(os.getenv('ELEVENLABS_RATE', '10'))
+ELEVENLABS_BURST = int(os.getenv('ELEVENLABS_BURST', '10'))
+# ElevenLabs plans cap concurrent requests; a TTS stream holds its slot until the audio is complete
+ELEVENLABS_CONCURRENCY = int(os.getenv('ELEVENLABS_CONCURRENCY', '10'))
+
+# Retries of a 429/5xx answer, with full-jitter exponential backoff (Retry-After wins when longer)
+UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', '2'))
+UPSTREAM_BACKOFF_BASE = float(os.getenv('UPSTREAM_BACKOFF_BASE', '0.2'))
+UPSTREAM_BACKOFF_MAX = float(os.getenv('UPSTREAM_BACKOFF_MAX', '2'))
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+# The call an upstream request is made for; tasks inherit it from the handler that set it
+current_call_sid = ContextVar('current_call_sid', default=None)
+
+class VendorGate:
+    """Token bucket plus concurrency cap for one vendor.
+
+    Waiting requests are queued per call and granted round-robin across
+    calls, so one call with many requests in flight cannot starve the rest.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, concurrency: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.active = 0
+        self._waiting = OrderedDict()
+        self._timer = None
+        ADMISSION_QUEUED.labels(name).set_function(lambda: sum(len(waiters) for waiters in self._waiting.values()))
+
+    @asynccontextmanager
+    async def slot(self, call_sid: str = None):
+        enqueued_at = time.monotonic()
+        granted = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(call_sid, deque()).append(granted)
+        self._dispatch()
+
+        try:
+            await granted
+        except asyncio.CancelledError:
+            if granted.done() and not granted.cancelled():
+                self._release()
+            else:
+                granted.cancel()
+            raise
+        admission_wait(self.name, enqueued_at)
+
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        self._refill()
+        while self._waiting and self.active < self.concurrency:
+            if self.tokens < 1:
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later((1 - self.tokens) / self.rate, self._on_timer)
+                return
+
+            # Next call in turn: serve its oldest request, then move it to the back of the line
+            call_sid, waiters = next(iter(self._waiting.items()))
+            granted = waiters.popleft()
+            if waiters:
+                self._waiting.move_to_end(call_sid)
+            else:
+                del self._waiting[call_sid]
+            if granted.done():
+                continue  # Cancelled while waiting
+
+            self.tokens -= 1
+            self.active += 1
+            granted.set_result(None)
+
+class AdmissionController:
+    def __init__(self):
+        self.gates = {
+            'openai': VendorGate('openai', OPENAI_RATE, OPENAI_BURST, OPENAI_CONCURRENCY),
+            'elevenlabs': VendorGate('elevenlabs', ELEVENLABS_RATE, ELEVENLABS_BURST, ELEVENLABS_CONCURRENCY),
+        }
+
+admission = AdmissionController() if ADMISSION_ENABLED else None
+
+@asynccontextmanager
+async def admitted(vendor: str):
+    """Hold an admission slot for `vendor` on behalf of the current call (no-op when disabled)."""
+    gate = admission.gates.get(vendor) if admission is not None else None
+    if gate is None:
+        yield
+        return
+    async with gate.slot(current_call_sid.get()):
+        yield
+
+def should_retry(status: int, attempt: int) -> bool:
+    return status in RETRY_STATUSES and attempt < UPSTREAM_RETRIES
+
+async def backoff(vendor: str, attempt: int, retry_after: str = None):
+    delay = random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** attempt))
+    if retry_after:
+        try:
+            delay = max(delay, min(float(retry_after), UPSTREAM_BACKOFF_MAX))
+        except ValueError:
+            pass
+    upstream_retry(vendor)
+    logging.warning("Retrying %s request in %.2fs (attempt %d)", vendor, delay, attempt + 1)
+    await asyncio.sleep(delay)
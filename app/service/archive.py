@@ -0,0 +1,151 @@
+import asyncio
+import gzip
+import logging
+import os
+import re
+from typing import AsyncIterator
+
+from .metrics import ARCHIVE_BUFFERED_BYTES, archive_dropped, archive_written
+
+# Record inbound caller audio and the TTS audio played back, per CallSid
+ARCHIVE_ENABLED = os.getenv('ARCHIVE_ENABLED', 'false').lower() == 'true'
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', '/tmp/call-audio')
+# Audio held in memory waiting for the writer; beyond this, new audio is dropped rather than slowing calls
+ARCHIVE_MAX_BUFFERED_BYTES = int(os.getenv('ARCHIVE_MAX_BUFFERED_BYTES', str(16 * 1024 * 1024)))
+# The writer runs when this much is buffered, or every ARCHIVE_FLUSH_INTERVAL seconds
+ARCHIVE_FLUSH_BYTES = int(os.getenv('ARCHIVE_FLUSH_BYTES', str(256 * 1024)))
+ARCHIVE_FLUSH_INTERVAL = float(os.getenv('ARCHIVE_FLUSH_INTERVAL', '2'))
+# Audio bytes per file before a new segment starts (about 8 minutes of 8 kHz μ-law)
+ARCHIVE_SEGMENT_BYTES = int(os.getenv('ARCHIVE_SEGMENT_BYTES', str(4 * 1024 * 1024)))
+# Each append becomes one gzip member; concatenated members are still a valid .gz file
+ARCHIVE_COMPRESS = os.getenv('ARCHIVE_COMPRESS', 'false').lower() == 'true'
+
+# Track names double as file stem and extension
+INBOUND_TRACK = 'inbound.ulaw'
+TTS_MP3_TRACK = 'tts.mp3'  # /elevenlabs/stream, played with <Play>
+TTS_ULAW_TRACK = 'tts.ulaw'  # media_stream playback
+
+UNSAFE_PATH = re.compile(r'[^\w-]')
+
+class CallArchiver:
+    """Records call audio to disk off the call's hot path.
+
+    `tap()` only appends to an in-memory buffer, or drops the data when the
+    buffer is full. A background task hands everything buffered to a thread
+    that appends it to segmented files under `<directory>/<CallSid>/`.
+    """
+
+    def __init__(self, directory: str = ARCHIVE_DIR, max_buffered: int = ARCHIVE_MAX_BUFFERED_BYTES,
+                 flush_bytes: int = ARCHIVE_FLUSH_BYTES, flush_interval: float = ARCHIVE_FLUSH_INTERVAL,
+                 segment_bytes: int = ARCHIVE_SEGMENT_BYTES, compress: bool = ARCHIVE_COMPRESS):
+        self.directory = directory
+        self.max_buffered = max_buffered
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.compress = compress
+        self.buffered = 0
+        self.dropped = 0
+        self._pending = {}
+        self._segments = {}
+        self._finished = set()
+        self._flush_now = asyncio.Event()
+        self._writer = None
+        self._closing = False
+        ARCHIVE_BUFFERED_BYTES.set_function(lambda: self.buffered)
+
+    async def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._writer = asyncio.create_task(self._run())
+
+    async def close(self):
+        # Stopped by flag rather than cancelled, so a write in progress always completes
+        self._closing = True
+        self._flush_now.set()
+        if self._writer is not None:
+            await self._writer
+        self._finished.update(call_sid for call_sid, _ in self._pending)
+        await self._flush()
+
+    def tap(self, call_sid: str, track: str, data):
+        if call_sid is None:
+            return
+        size = len(data)
+        if self.buffered + size > self.max_buffered:
+            self.dropped += size
+            archive_dropped(size)
+            return
+
+        buffer = self._pending.get((call_sid, track))
+        if buffer is None:
+            buffer = self._pending[(call_sid, track)] = bytearray()
+        buffer += data
+        self.buffered += size
+        if self.buffered >= self.flush_bytes:
+            self._flush_now.set()
+
+    async def record(self, audio: AsyncIterator[bytes], call_sid: str, track: str) -> AsyncIterator[bytes]:
+        """Pass `audio` through, tapping every chunk into `track`."""
+        async for chunk in audio:
+            self.tap(call_sid, track, chunk)
+            yield chunk
+
+    def finish(self, call_sid: str):
+        """The call is over: write what is left of it and forget its files."""
+        self._finished.add(call_sid)
+        self._flush_now.set()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            await self._flush()
+
+    async def _flush(self):
+        pending, self._pending = self._pending, {}
+        finished, self._finished = self._finished, set()
+        size = sum(len(data) for data in pending.values())
+        if pending:
+            try:
+                await asyncio.to_thread(self._write, pending)
+            except Exception as e:
+                logging.error(f"Error while archiving call audio: {str(e)}")
+            finally:
+                self.buffered -= size
+
+        for key in [key for key in self._segments if key[0] in finished]:
+            del self._segments[key]
+
+    def _path(self, call_sid: str, track: str, index: int) -> str:
+        stem, _, extension = track.partition('.')
+        name = f'{stem}-{index:04d}.{extension}'
+        if self.compress:
+            name += '.gz'
+        return os.path.join(self.directory, UNSAFE_PATH.sub('_', call_sid), name)
+
+    def _resume(self, call_sid: str, track: str) -> list:
+        # Audio after a `finish()` (or a restart) goes to a new segment rather than into an old one
+        index = 0
+        while os.path.exists(self._path(call_sid, track, index)):
+            index += 1
+        return [index, 0]
+
+    def _write(self, pending: dict):
+        """Runs in a worker thread: append each buffer to its current segment, rotating when full."""
+        for (call_sid, track), data in pending.items():
+            os.makedirs(os.path.dirname(self._path(call_sid, track, 0)), exist_ok=True)
+            segment = self._segments.get((call_sid, track)) or self._resume(call_sid, track)
+            view = memoryview(data)
+            while view:
+                if segment[1] >= self.segment_bytes:
+                    segment = [segment[0] + 1, 0]
+                piece = view[:self.segment_bytes - segment[1]]
+                view = view[len(piece):]
+                with open(self._path(call_sid, track, segment[0]), 'ab') as f:
+                    f.write(gzip.compress(piece, compresslevel=6) if self.compress else piece)
+                segment[1] += len(piece)
+            self._segments[(call_sid, track)] = segment
+            archive_written(len(data))
@@ -0,0 +1,163 @@
+import asyncio
+import binascii
+import os
+import weakref
+from collections import deque
+
+from .metrics import AUDIO_QUEUE_DEPTH_SECONDS, audio_dropped, audio_queue_closed
+
+# Audio handed to STT per websocket frame (Twilio sends 20 ms per media event)
+AUDIO_FLUSH_MS = int(os.getenv('AUDIO_FLUSH_MS', '100'))
+AUDIO_FLUSH_BYTES = int(os.getenv('AUDIO_FLUSH_BYTES', str(8000 * AUDIO_FLUSH_MS // 1000)))
+# Preallocated segments per call; more are allocated only while STT lags behind
+AUDIO_RING_SEGMENTS = int(os.getenv('AUDIO_RING_SEGMENTS', '16'))
+
+# Audio allowed to wait for the STT sender before the overflow policy kicks in
+AUDIO_QUEUE_MAX_MS = int(os.getenv('AUDIO_QUEUE_MAX_MS', '2000'))
+# 'drop_oldest', 'drop_silence' (quiet audio first, then the oldest) or 'disconnect'
+AUDIO_QUEUE_POLICY = os.getenv('AUDIO_QUEUE_POLICY', 'drop_oldest')
+# Peak 16-bit level under which a queued chunk counts as silence for 'drop_silence'
+AUDIO_QUEUE_SILENCE_PEAK = int(os.getenv('AUDIO_QUEUE_SILENCE_PEAK', '1000'))
+
+def _ulaw_magnitude(byte: int) -> int:
+    ulaw = ~byte & 0xFF
+    exponent = (ulaw >> 4) & 0x07
+    mantissa = ulaw & 0x0F
+    return (((mantissa << 3) + 0x84) << exponent) - 0x84
+
+# Maps each μ-law byte to 1 if it is louder than the silence peak, so a chunk is checked with one translate()
+ULAW_LOUD = bytes(int(_ulaw_magnitude(byte) > AUDIO_QUEUE_SILENCE_PEAK) for byte in range(256))
+
+def is_silence(chunk) -> bool:
+    return 1 not in bytes(chunk).translate(ULAW_LOUD)
+
+class AudioCoalescer:
+    """Coalesces Twilio media payloads into fixed-size segments from a preallocated ring.
+
+    `write()` returns memoryviews of full segments; each one must be given
+    back with `release()` once it has been sent, which returns its segment
+    to the ring.
+    """
+
+    def __init__(self, flush_bytes: int = AUDIO_FLUSH_BYTES, segments: int = AUDIO_RING_SEGMENTS):
+        self.flush_bytes = flush_bytes
+        self.segments = segments
+        self._free = deque(bytearray(flush_bytes) for _ in range(segments))
+        self._segment = self._take()
+        self._fill = 0
+
+    def _take(self) -> bytearray:
+        return self._free.popleft() if self._free else bytearray(self.flush_bytes)
+
+    def write(self, payload) -> list:
+        """Decode a base64 payload into the ring and return the segments that filled up."""
+        data = memoryview(binascii.a2b_base64(payload))
+        flushed = []
+
+        while data:
+            count = min(len(data), self.flush_bytes - self._fill)
+            self._segment[self._fill:self._fill + count] = data[:count]
+            self._fill += count
+            data = data[count:]
+            if self._fill == self.flush_bytes:
+                flushed.append(self.flush())
+
+        return flushed
+
+    def flush(self):
+        """Return whatever is buffered as a memoryview, or None if nothing is."""
+        if self._fill == 0:
+            return None
+
+        view = memoryview(self._segment)[:self._fill]
+        self._segment = self._take()
+        self._fill = 0
+        return view
+
+    def release(self, view: memoryview):
+        segment = view.obj
+        view.release()
+        if len(self._free) < self.segments:
+            self._free.append(segment)
+
+class AudioOverflow(Exception):
+    """The STT sender fell too far behind and the policy is 'disconnect'."""
+
+_live_queues = weakref.WeakSet()
+AUDIO_QUEUE_DEPTH_SECONDS.set_function(lambda: sum(queue.bytes for queue in _live_queues) / 8000)
+
+class AudioQueue:
+    """Audio between the Twilio reader and the STT sender, bounded by duration.
+
+    Items are (chunk, arrival time) pairs; chunks from an AudioCoalescer that
+    get dropped are released back to it. The "EOS" marker is never dropped.
+    """
+
+    def __init__(self, coalescer: AudioCoalescer, max_ms: int = AUDIO_QUEUE_MAX_MS, policy: str = AUDIO_QUEUE_POLICY):
+        self.coalescer = coalescer
+        self.max_bytes = 8 * max_ms
+        self.policy = policy
+        self.bytes = 0
+        self.high_water = 0
+        self.dropped = 0
+        self._items = deque()
+        self._ready = asyncio.Event()
+        _live_queues.add(self)
+
+    def put_nowait(self, chunk, arrived_at: float = None):
+        if isinstance(chunk, str):
+            self._items.append((chunk, arrived_at))
+            self._ready.set()
+            return
+
+        if self.bytes + len(chunk) > self.max_bytes:
+            if self.policy == 'disconnect':
+                self._release(chunk)
+                raise AudioOverflow(f'{self.bytes / 8:.0f} ms of audio waiting for STT')
+            self._make_room(len(chunk))
+
+        self._items.append((chunk, arrived_at))
+        self.bytes += len(chunk)
+        self.high_water = max(self.high_water, self.bytes)
+        self._ready.set()
+
+    def _make_room(self, size: int):
+        if self.policy == 'drop_silence':
+            for item in [item for item in self._items if not isinstance(item[0], str) and is_silence(item[0])]:
+                if self.bytes + size <= self.max_bytes:
+                    return
+                self._items.remove(item)
+                self._drop(item[0], 'silence')
+
+        while self.bytes + size > self.max_bytes and self._items and not isinstance(self._items[0][0], str):
+            self._drop(self._items.popleft()[0], 'oldest')
+
+    def _drop(self, chunk, kind: str):
+        self.bytes -= len(chunk)
+        self.dropped += len(chunk)
+        audio_dropped(kind, len(chunk) / 8000)
+        self._release(chunk)
+
+    def _release(self, chunk):
+        if isinstance(chunk, memoryview):
+            self.coalescer.release(chunk)
+
+    async def get(self) -> tuple:
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+
+        chunk, arrived_at = self._items.popleft()
+        if not isinstance(chunk, str):
+            self.bytes -= len(chunk)
+        return chunk, arrived_at
+
+    def close(self):
+        """Release whatever was never sent and record the high-water mark."""
+        while self._items:
+            chunk, _ = self._items.popleft()
+            if not isinstance(chunk, str):
+                self._release(chunk)
+        self.bytes = 0
+        _live_queues.discard(self)
+        audio_queue_closed(self.high_water / 8000)
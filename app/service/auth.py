@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import os
+import time
+
+from aiohttp import ClientSession
+
+from .metrics import vendor_error
+
+# Refresh this long before the token expires
+RTZR_TOKEN_REFRESH_MARGIN = float(os.getenv('RTZR_TOKEN_REFRESH_MARGIN', '600'))
+# Return Zero tokens are valid for 6 hours; used if the response carries no expiry
+RTZR_TOKEN_DEFAULT_TTL = 6 * 60 * 60
+RTZR_TOKEN_RETRY_MAX = 60
+
+class RtzrTokenManager:
+    """Keeps a valid Return Zero access token, refreshing it in the background.
+
+    Readers take `self.token` without locking; the refresher swaps in a new
+    token before the old one expires, so readers never wait after startup.
+    """
+
+    def __init__(self, session: ClientSession, url: str, client_id: str, client_secret: str,
+                 refresh_margin: float = RTZR_TOKEN_REFRESH_MARGIN):
+        self.session = session
+        self.url = url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_margin = refresh_margin
+        self.token = None
+        self.expires_at = 0.0
+        self._ready = asyncio.Event()
+        self._refresher = None
+
+    async def start(self):
+        # Does not wait for the first token; startup stays off the network
+        self._refresher = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+
+    async def get_token(self) -> str:
+        if self.token is not None and time.time() < self.expires_at:
+            return self.token
+        self._ready.clear()
+        if self._refresher is None or self._refresher.done():
+            await self.refresh()
+        else:
+            await self._ready.wait()
+        return self.token
+
+    async def refresh(self):
+        async with self.session.post(
+            self.url,
+            data={'client_id': self.client_id, 'client_secret': self.client_secret}
+        ) as resp:
+            resp.raise_for_status()
+            payload = await resp.json()
+
+        self.token = payload['access_token']
+        self.expires_at = float(payload.get('expire_at') or time.time() + RTZR_TOKEN_DEFAULT_TTL)
+        self._ready.set()
+        logging.info("Refreshed Returnzero token, valid for %.0f s", self.expires_at - time.time())
+
+    async def _run(self):
+        retry = 1
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                vendor_error('returnzero')
+                logging.error(f"Failed to refresh Returnzero token: {str(e)}")
+                await asyncio.sleep(retry)
+                retry = min(retry * 2, RTZR_TOKEN_RETRY_MAX)
+                continue
+
+            retry = 1
+            await asyncio.sleep(max(self.expires_at - time.time() - self.refresh_margin, 1))
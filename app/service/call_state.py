@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import os
+from typing import AsyncIterator
+
+from .session import CallSessionRegistry, CALL_SESSION_IDLE_TTL
+
+# 'memory' keeps call state in this process; 'redis' shares it between workers and nodes
+CALL_STATE_BACKEND = os.getenv('CALL_STATE_BACKEND', 'memory')
+CALL_STATE_URL = os.getenv('CALL_STATE_URL', 'redis://localhost:6379/0')
+CALL_STATE_MAX_CONNECTIONS = int(os.getenv('CALL_STATE_MAX_CONNECTIONS', '500'))
+# Waiting /continue requests and sentence streams BLPOP on a separate pool; past this many, they queue for a connection
+CALL_STATE_BLOCKING_CONNECTIONS = int(os.getenv('CALL_STATE_BLOCKING_CONNECTIONS', '200'))
+# Longest single BLPOP; waiters give their connection back this often
+CALL_STATE_POLL_TIMEOUT = float(os.getenv('CALL_STATE_POLL_TIMEOUT', '2'))
+
+END_OF_SENTENCES = '\x00'
+
+class InProcessCallState:
+    """Call state kept on the local CallSession objects (single-process deployments)."""
+
+    def __init__(self, registry: CallSessionRegistry):
+        self.registry = registry
+
+    async def close(self):
+        pass
+
+    async def create(self, call_sid: str):
+        self.registry.create(call_sid)
+
+    async def exists(self, call_sid: str) -> bool:
+        return self.registry.get(call_sid) is not None
+
+    async def evict(self, call_sid: str):
+        pass  # The registry entry is the state
+
+    async def push_response(self, call_sid: str, response: str):
+        call = self.registry.get(call_sid)
+        if call is not None:
+            call.response_queue.put_nowait(response)
+
+    async def pop_response(self, call_sid: str) -> str:
+        call = self.registry.get(call_sid)
+        if call is None:
+            return 'END_TRANSCRIPT_MARKER'  # Evicted: the call is over
+        return await call.response_queue.get()
+
+    async def set_transcript(self, call_sid: str, transcript: str):
+        call = self.registry.get(call_sid)
+        if call is not None:
+            call.transcript = transcript
+
+    async def get_transcript(self, call_sid: str) -> str:
+        call = self.registry.get(call_sid)
+        return call.transcript if call is not None else ''
+
+    async def start_sentences(self, call_sid: str):
+        """Open the sentence stream for a new turn and return its writer."""
+        sentence_queue = asyncio.Queue()
+        call = self.registry.get(call_sid)
+        if call is not None:
+            call.sentence_queue = sentence_queue
+        return QueueSentenceWriter(sentence_queue)
+
+    async def take_sentences(self, call_sid: str):
+        """Claim the sentence stream of the current turn, or None if there is none."""
+        call = self.registry.get(call_sid)
+        if call is None or call.sentence_queue is None:
+            return None
+        sentence_queue, call.sentence_queue = call.sentence_queue, None
+        return _iter_queue(sentence_queue)
+
+class QueueSentenceWriter:
+    def __init__(self, sentence_queue: asyncio.Queue):
+        self.sentence_queue = sentence_queue
+
+    async def push(self, sentence: str):
+        self.sentence_queue.put_nowait(sentence)
+
+    async def end(self):
+        self.sentence_queue.put_nowait(None)
+
+async def _iter_queue(sentence_queue: asyncio.Queue) -> AsyncIterator[str]:
+    while True:
+        sentence = await sentence_queue.get()
+        if sentence is None:
+            break
+        yield sentence
+
+class RedisCallState:
+    """Call state in Redis, so every step of a call can be served by any worker.
+
+    Responses and sentences are Redis lists consumed with BLPOP; every key
+    expires after the idle TTL, so abandoned calls clean themselves up.
+    BLPOPs run on `blocking_client` with a bounded timeout, so waiting calls
+    neither exhaust the pool every other operation uses nor pin a connection
+    each for the whole time the caller is thinking.
+    """
+
+    def __init__(self, client, blocking_client=None, ttl: float = CALL_SESSION_IDLE_TTL, poll_timeout: float = CALL_STATE_POLL_TIMEOUT):
+        self.client = client
+        self.blocking_client = blocking_client if blocking_client is not None else client
+        self.ttl = int(ttl)
+        self.poll_timeout = poll_timeout
+
+    @classmethod
+    def from_url(cls, url: str = CALL_STATE_URL):
+        import redis.asyncio as redis
+        client = redis.from_url(url, decode_responses=True, max_connections=CALL_STATE_MAX_CONNECTIONS)
+        blocking_pool = redis.BlockingConnectionPool.from_url(
+            url, decode_responses=True, max_connections=CALL_STATE_BLOCKING_CONNECTIONS, timeout=None,
+        )
+        return cls(client, redis.Redis(connection_pool=blocking_pool))
+
+    async def close(self):
+        await self.client.aclose()
+        if self.blocking_client is not self.client:
+            await self.blocking_client.aclose()
+
+    def _key(self, call_sid: str, *parts) -> str:
+        return ':'.join(('call', call_sid) + parts)
+
+    async def create(self, call_sid: str):
+        key = self._key(call_sid)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hsetnx(key, 'transcript', '')
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def exists(self, call_sid: str) -> bool:
+        return bool(await self.client.exists(self._key(call_sid)))
+
+    async def evict(self, call_sid: str):
+        # Responses stay until they expire: a waiting /continue request may still need the end marker
+        await self.client.delete(self._key(call_sid))
+
+    async def push_response(self, call_sid: str, response: str):
+        key = self._key(call_sid, 'responses')
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.rpush(key, response)
+            pipe.expire(key, self.ttl)
+            pipe.expire(self._key(call_sid), self.ttl)
+            await pipe.execute()
+
+    async def _pop(self, key: str, call_sid: str):
+        """Next item of the list at `key`, or None once the call is gone and the list is empty."""
+        while True:
+            item = await self.blocking_client.blpop(key, timeout=self.poll_timeout)
+            if item is not None:
+                return item[1]
+            if not await self.blocking_client.exists(self._key(call_sid)):
+                return None
+
+    async def pop_response(self, call_sid: str) -> str:
+        response = await self._pop(self._key(call_sid, 'responses'), call_sid)
+        return response if response is not None else 'END_TRANSCRIPT_MARKER'
+
+    async def _hset(self, call_sid: str, field: str, value):
+        # A bare HSET on an evicted or expired call would recreate its hash without a TTL
+        key = self._key(call_sid)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hset(key, field, value)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def set_transcript(self, call_sid: str, transcript: str):
+        await self._hset(call_sid, 'transcript', transcript)
+
+    async def get_transcript(self, call_sid: str) -> str:
+        return await self.client.hget(self._key(call_sid), 'transcript') or ''
+
+    async def start_sentences(self, call_sid: str):
+        turn = await self.client.incr(self._key(call_sid, 'turn'))
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.expire(self._key(call_sid, 'turn'), self.ttl)
+            pipe.hset(self._key(call_sid), 'sentences', turn)
+            pipe.expire(self._key(call_sid), self.ttl)
+            await pipe.execute()
+        return RedisSentenceWriter(self.client, self._key(call_sid, 'sentences', str(turn)), self.ttl)
+
+    async def take_sentences(self, call_sid: str):
+        key = self._key(call_sid)
+        turn = await self.client.hget(key, 'sentences')
+        # HDEL decides which of several concurrent fetches owns the stream
+        if turn is None or not await self.client.hdel(key, 'sentences'):
+            return None
+        return self._iter_sentences(self._key(call_sid, 'sentences', turn), call_sid)
+
+    async def _iter_sentences(self, key: str, call_sid: str) -> AsyncIterator[str]:
+        try:
+            while True:
+                sentence = await self._pop(key, call_sid)
+                if sentence is None or sentence == END_OF_SENTENCES:
+                    break
+                yield sentence
+        finally:
+            await self.client.delete(key)
+
+class RedisSentenceWriter:
+    def __init__(self, client, key: str, ttl: int):
+        self.client = client
+        self.key = key
+        self.ttl = ttl
+
+    async def push(self, sentence: str):
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.rpush(self.key, sentence)
+            pipe.expire(self.key, self.ttl)
+            await pipe.execute()
+
+    async def end(self):
+        await self.push(END_OF_SENTENCES)
+
+def create_call_state(registry: CallSessionRegistry):
+    if CALL_STATE_BACKEND == 'redis':
+        logging.info("Using Redis call state backend at %s", CALL_STATE_URL)
+        return RedisCallState.from_url(CALL_STATE_URL)
+    return InProcessCallState(registry)
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import os
+
+import asyncpg
+
+from .. import HOST, DATABASE, USER, PASSWORD
+
+# 0 opens connections on first use, so startup never waits on (or fails with) Postgres
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '0'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+# Updates arriving within this window are written with a single statement
+DB_BATCH_WINDOW = float(os.getenv('DB_BATCH_WINDOW', '0.05'))
+DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', '500'))
+
+# Row identifier carried in learntoservingqueue messages
+MODEL_KEY_COLUMN = os.getenv('MODEL_KEY_COLUMN', 'id')
+MODEL_KEY_TYPE = os.getenv('MODEL_KEY_TYPE', 'bigint')
+MODEL_UPDATE_COLUMNS = ('gpt_id', 'voice_id')
+
+async def create_db_pool() -> asyncpg.Pool:
+    return await asyncpg.create_pool(
+        host=HOST,
+        database=DATABASE,
+        user=USER,
+        password=PASSWORD,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+    )
+
+def _update_statement(column: str) -> str:
+    return (
+        f"UPDATE model AS m SET {column} = v.value "
+        f"FROM unnest($1::text[], $2::text[]) AS v(key, value) "
+        f"WHERE m.{MODEL_KEY_COLUMN} = v.key::{MODEL_KEY_TYPE}"
+    )
+
+class ModelUpdateBatcher:
+    """Coalesces `model` updates into one multi-row UPDATE per column.
+
+    Callers await `update()` and are released once the batch containing
+    their row has been committed (or with the error that failed it).
+    asyncpg prepares and caches the statement per pooled connection.
+    """
+
+    def __init__(self, pool: asyncpg.Pool, window: float = DB_BATCH_WINDOW, max_batch: int = DB_BATCH_SIZE):
+        self.pool = pool
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        self._flusher = None
+        self._writes = set()
+
+    async def update(self, column: str, key: str, value: str):
+        if column not in MODEL_UPDATE_COLUMNS:
+            raise ValueError(f"Unsupported model column: {column}")
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((column, str(key), value, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush_now()
+        elif self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_later())
+
+        await future
+
+    def _flush_now(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        pending, self._pending = self._pending, []
+        task = asyncio.create_task(self._write(pending))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._flusher = None
+        pending, self._pending = self._pending, []
+        await self._write(pending)
+
+    async def _write(self, pending: list):
+        by_column = {}
+        for column, key, value, future in pending:
+            # Last write per row wins, as it would with sequential UPDATEs
+            by_column.setdefault(column, {})[key] = value
+
+        try:
+            async with self.pool.acquire() as connection:
+                async with connection.transaction():
+                    for column, rows in by_column.items():
+                        await connection.execute(_update_statement(column), list(rows), list(rows.values()))
+        except Exception as e:
+            logging.error(f"Error updating model records: {str(e)}")
+            for *_, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        logging.info("Updated %d model records in one batch", len(pending))
+        for *_, future in pending:
+            if not future.done():
+                future.set_result(None)
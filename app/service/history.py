@@ -0,0 +1,49 @@
+import os
+
+# Prompt budget for the per-call conversation window (system prompt excluded)
+HISTORY_MAX_TOKENS = int(os.getenv('HISTORY_MAX_TOKENS', '1500'))
+# 'truncate' drops the oldest turns, 'summarize' folds them into a running summary
+HISTORY_STRATEGY = os.getenv('HISTORY_STRATEGY', 'truncate')
+
+def estimate_tokens(text: str) -> int:
+    # Roughly 4 bytes per token; close enough for budgeting without a tokenizer
+    return len(text.encode('utf-8')) // 4 + 1
+
+class ConversationHistory:
+    """Conversation of a single call, kept within a token budget."""
+
+    def __init__(self, system_prompt: str, max_tokens: int = HISTORY_MAX_TOKENS, strategy: str = HISTORY_STRATEGY):
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.strategy = strategy
+        self.summary = ''
+        self.unsummarized = []  # Dropped turns not yet folded into the summary
+        self.summarizer = None  # The one task folding them in, in order
+        self.turns = []
+        self.tokens = 0
+
+    def messages(self, user_message: str = None) -> list:
+        """Build the chat payload, optionally ending with a new, uncommitted user message."""
+        messages = [{'role': 'system', 'content': self.system_prompt}]
+        if self.summary:
+            messages.append({'role': 'system', 'content': f'Summary of the earlier conversation: {self.summary}'})
+        messages.extend(self.turns)
+        if user_message is not None:
+            messages.append({'role': 'user', 'content': user_message})
+        return messages
+
+    def add(self, user_message: str, assistant_message: str) -> list:
+        """Commit a finished turn and return the turns pushed out of the window."""
+        self.turns.append({'role': 'user', 'content': user_message})
+        self.turns.append({'role': 'assistant', 'content': assistant_message})
+        self.tokens += estimate_tokens(user_message) + estimate_tokens(assistant_message)
+
+        dropped = []
+        # Always keep the latest turn, even if it alone exceeds the budget
+        while self.tokens > self.max_tokens and len(self.turns) > 2:
+            for message in self.turns[:2]:
+                self.tokens -= estimate_tokens(message['content'])
+            dropped.extend(self.turns[:2])
+            del self.turns[:2]
+
+        return dropped
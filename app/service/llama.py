@@ -1,45 +1,281 @@
+import asyncio
+import itertools
+import json
 import logging
 import os
+import re
+import time
+from typing import AsyncIterator
+
+from aiohttp import ClientError
 from fastapi import Request
-from openai import OpenAI
+
+from .admission import admitted, backoff, should_retry
+from .history import ConversationHistory
+from .llm_cache import llm_cache, llm_cache_key
+from .metrics import observe_stage, vendor_error
+from .session import CallSession
+from .tts import elevenlabs_request, tts_sentence_stream_generator
 
 from dotenv import load_dotenv
 load_dotenv()
 
 OPENAI_MODEL_ID = os.getenv('OPENAI_MODEL_ID')
+OPENAI_CHAT_URL = os.getenv('OPENAI_CHAT_URL', 'https://api.openai.com/v1/chat/completions')
+
+# Stream the completion and hand it to TTS sentence by sentence
+LLM_STREAMING = os.getenv('LLM_STREAMING', 'false').lower() == 'true'
+STREAMING_RESPONSE_MARKER = 'STREAMING_RESPONSE_MARKER'
 
 SYSTEM_MESSAGE_CONTENT ="""
 You are an assistant tasked with providing engaging and relevant responses based on the given conversation context. Respond thoughtfully and appropriately to user inputs.
 """
 
-async def get_chatgpt_response(call_sid: str, prompt: str, request: Request) -> str:
-    response = await call_chatgpt(prompt, request)
-    request.app.state.convos[call_sid] += f'\n\nYou: {prompt}\n\nAssistant: {response}'
+SUMMARY_MESSAGE_CONTENT = """
+Summarize the following phone conversation in a few short sentences. Keep names, numbers and anything the caller asked for.
+"""
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?。？！])\s+|\n+')
+
+def assistant_text(response: str) -> str:
+    """The part of a completion that is spoken to the caller."""
+    if "Assistant:" in response:
+        return response.split("Assistant:", 1)[1].strip()
+    return response.strip()
+
+def get_history(call: CallSession) -> ConversationHistory:
+    if call.history is None:
+        call.history = ConversationHistory(SYSTEM_MESSAGE_CONTENT)
+    return call.history
+
+def response_cache_key(history: ConversationHistory, prompt: str):
+    if llm_cache is None or not llm_cache.cacheable(prompt):
+        return None
+    return llm_cache_key(OPENAI_MODEL_ID, history, prompt)
+
+_summary_tasks = set()
+
+def commit_turn(request: Request, history: ConversationHistory, prompt: str, response: str):
+    dropped = history.add(prompt, response)
+    if dropped and history.strategy == 'summarize':
+        history.unsummarized.extend(dropped)
+        # Summarize off the turn's critical path; the next prompt picks it up when ready.
+        # One summarizer per history, so each summary builds on the previous one
+        if history.summarizer is None or history.summarizer.done():
+            task = history.summarizer = asyncio.create_task(summarize_history(history, request))
+            _summary_tasks.add(task)
+            task.add_done_callback(_summary_tasks.discard)
+
+async def get_chatgpt_response(call: CallSession, prompt: str, request: Request, speculation=None) -> str:
+    history = get_history(call)
+    started_at = time.monotonic()
+    cache_key = response_cache_key(history, prompt)
+    cached = llm_cache.get(cache_key) if cache_key is not None else None
+    if cached is not None:
+        response = cached
+        if speculation is not None:
+            speculation.cancel('cached')
+    elif speculation is not None:
+        response = await speculation.response()
+    else:
+        response = await call_chatgpt(prompt, request, history)
+    observe_stage('llm', started_at)
+    if response:
+        if cache_key is not None and cached is None:
+            llm_cache.put(cache_key, response)
+        commit_turn(request, history, prompt, response)
 
     return response
 
-conversation = [{'role':'system', 'content': SYSTEM_MESSAGE_CONTENT}]
-async def call_chatgpt(message: str, request: Request) -> str:
+async def stream_chatgpt_response(call: CallSession, prompt: str, request: Request, speculation=None) -> str:
+    """Publish sentences to the call's sentence stream as the completion streams in.
+
+    The response queue is signalled on the first sentence so Twilio can start
+    fetching audio while the rest of the answer is still being generated.
+    A promoted `speculation` replays the sentences it has already buffered.
+    """
+    state = request.app.state.call_state
+    history = get_history(call)
+    writer = None
+    sentences = []
+    started_at = time.monotonic()
+    cache_key = response_cache_key(history, prompt)
+    cached = llm_cache.get(cache_key) if cache_key is not None else None
+    if cached is not None:
+        stream = replay_sentences(cached)
+        if speculation is not None:
+            speculation.cancel('cached')
+    elif speculation is not None:
+        stream = speculation.stream()
+    else:
+        stream = stream_chatgpt(prompt, request, history)
+
+    try:
+        async for sentence in stream:
+            if writer is None:
+                observe_stage('llm_first_sentence', started_at)
+                writer = await state.start_sentences(call.call_sid)
+                prefetch = request.app.state.tts_prefetch
+                if prefetch is not None:
+                    # Synthesize from the first sentence on; the stream endpoint tails the buffer
+                    voice_id, headers, payload = elevenlabs_request('')
+                    prefetch.start(call.call_sid, tts_sentence_stream_generator(
+                        request.app.state.session, voice_id, headers, payload, await state.take_sentences(call.call_sid),
+                        cache=request.app.state.tts_cache,
+                    ))
+                await state.push_response(call.call_sid, STREAMING_RESPONSE_MARKER)
+            sentences.append(sentence)
+            await writer.push(sentence)
+    finally:
+        if writer is not None:
+            await writer.end()
+
+    observe_stage('llm', started_at)
+    response = ' '.join(sentences)
+    if response:
+        if cache_key is not None and cached is None:
+            llm_cache.put(cache_key, response)
+        commit_turn(request, history, prompt, response)
+        # Fallback text for a repeated fetch of the stream endpoint
+        await state.set_transcript(call.call_sid, response)
+
+    return response
+
+def split_sentences(text: str) -> tuple[list[str], str]:
+    """Split off every complete sentence, returning them and the unfinished tail."""
+    parts = SENTENCE_BOUNDARY.split(text)
+    tail = parts.pop()
+    return [part.strip() for part in parts if part.strip()], tail
+
+async def replay_sentences(text: str) -> AsyncIterator[str]:
+    sentences, tail = split_sentences(text)
+    for sentence in sentences:
+        yield sentence
+    if tail.strip():
+        yield tail.strip()
+
+async def call_chatgpt(message: str, request: Request, history: ConversationHistory) -> str:
     session = request.app.state.session
-    url = 'https://api.openai.com/v1/chat/completions'
     key = os.getenv('OPENAI_API_KEY')
 
     headers = {'Authorization': f"Bearer {key}"}
 
-    conversation.append({'role': 'user', 'content': message})
-
-    payload = {'model': OPENAI_MODEL_ID, 'messages': conversation}
+    payload = {'model': OPENAI_MODEL_ID, 'messages': history.messages(message)}
 
     logging.info('Sending to ChatGPT -> User: %s', message)
 
-    async with session.post(url, headers=headers, json=payload) as resp:
-        if resp.status != 200:
+    for attempt in itertools.count():
+        try:
+            async with admitted('openai'):
+                async with session.post(OPENAI_CHAT_URL, headers=headers, json=payload) as resp:
+                    if resp.status == 200:
+                        resp_payload = await resp.json()
+                        response = resp_payload['choices'][0]['message']['content'].strip()
+                        break
+                    vendor_error('openai')
+                    status, retry_after = resp.status, resp.headers.get('Retry-After')
+        except (ClientError, asyncio.TimeoutError) as e:
+            # Includes UPSTREAM_READ_TIMEOUT: the turn goes unanswered, the call carries on
+            vendor_error('openai')
+            logging.error(f"Error while calling ChatGPT: {str(e)}")
             return ''
-        resp_payload = await resp.json()
-        response = resp_payload['choices'][0]['message']['content'].strip()
-
-    conversation.append({'role': 'assistant', 'content': response})
+        if not should_retry(status, attempt):
+            return ''
+        await backoff('openai', attempt, retry_after)
 
     logging.info('ChatGPT: %s', response)
 
     return response
+
+async def stream_chatgpt(message: str, request: Request, history: ConversationHistory) -> AsyncIterator[str]:
+    """Like `call_chatgpt`, but yields complete sentences while the SSE deltas arrive."""
+    session = request.app.state.session
+    key = os.getenv('OPENAI_API_KEY')
+
+    headers = {'Authorization': f"Bearer {key}"}
+
+    payload = {'model': OPENAI_MODEL_ID, 'messages': history.messages(message), 'stream': True}
+
+    logging.info('Streaming from ChatGPT -> User: %s', message)
+
+    parts = []
+    pending = ''
+    for attempt in itertools.count():
+        try:
+            # The slot is held while the completion streams in
+            async with admitted('openai'):
+                async with session.post(OPENAI_CHAT_URL, headers=headers, json=payload) as resp:
+                    if resp.status == 200:
+                        async for line in resp.content:
+                            line = line.strip()
+                            if not line.startswith(b'data:'):
+                                continue
+                            data = line[5:].strip()
+                            if data == b'[DONE]':
+                                break
+
+                            choices = json.loads(data).get('choices')
+                            delta = choices[0]['delta'].get('content') if choices else None
+                            if not delta:
+                                continue
+
+                            parts.append(delta)
+                            sentences, pending = split_sentences(pending + delta)
+                            for sentence in sentences:
+                                yield sentence
+                        break
+                    vendor_error('openai')
+                    status, retry_after = resp.status, resp.headers.get('Retry-After')
+        except (ClientError, asyncio.TimeoutError) as e:
+            vendor_error('openai')
+            logging.error(f"Error while streaming from ChatGPT: {str(e)}")
+            return
+        if not should_retry(status, attempt):
+            return
+        await backoff('openai', attempt, retry_after)
+
+    if pending.strip():
+        yield pending.strip()
+
+    logging.info('ChatGPT: %s', ''.join(parts).strip())
+
+async def summarize_history(history: ConversationHistory, request: Request):
+    """Fold the dropped turns into the summary, batch by batch, until none are left."""
+    while history.unsummarized:
+        dropped, history.unsummarized = history.unsummarized, []
+        if not await fold_into_summary(history, dropped, request):
+            # Keep them for the next attempt, ahead of anything dropped meanwhile
+            history.unsummarized[:0] = dropped
+            return
+
+async def fold_into_summary(history: ConversationHistory, dropped: list, request: Request) -> bool:
+    session = request.app.state.session
+    key = os.getenv('OPENAI_API_KEY')
+
+    headers = {'Authorization': f"Bearer {key}"}
+
+    transcript = '\n'.join(f"{message['role']}: {message['content']}" for message in dropped)
+    if history.summary:
+        transcript = f'{history.summary}\n{transcript}'
+
+    payload = {
+        'model': OPENAI_MODEL_ID,
+        'messages': [
+            {'role': 'system', 'content': SUMMARY_MESSAGE_CONTENT},
+            {'role': 'user', 'content': transcript},
+        ],
+        'max_tokens': 200,
+    }
+
+    try:
+        async with admitted('openai'):
+            async with session.post(OPENAI_CHAT_URL, headers=headers, json=payload) as resp:
+                if resp.status != 200:
+                    logging.warning('Failed to summarize conversation. Status: %s', resp.status)
+                    return False
+                resp_payload = await resp.json()
+                history.summary = resp_payload['choices'][0]['message']['content'].strip()
+                return True
+    except Exception as e:
+        logging.error(f"Error while summarizing conversation: {str(e)}")
+        return False
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+
+from .history import ConversationHistory
+from .metrics import llm_cache_request
+
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'false').lower() == 'true'
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '1000'))
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', '3600'))
+# Previous messages folded into the key; 0 answers the same question the same way whatever came before
+LLM_CACHE_CONTEXT_MESSAGES = int(os.getenv('LLM_CACHE_CONTEXT_MESSAGES', '0'))
+# Long utterances practically never repeat word for word
+LLM_CACHE_MAX_UTTERANCE_CHARS = int(os.getenv('LLM_CACHE_MAX_UTTERANCE_CHARS', '120'))
+
+PUNCTUATION = re.compile(r'[^\w\s]')
+
+def normalize_utterance(text: str) -> str:
+    text = unicodedata.normalize('NFC', text).lower()
+    return ' '.join(PUNCTUATION.sub(' ', text).split())
+
+def llm_cache_key(model: str, history: ConversationHistory, utterance: str, context_messages: int = LLM_CACHE_CONTEXT_MESSAGES) -> str:
+    key = {
+        'model': model,
+        'system_prompt': history.system_prompt,
+        'utterance': normalize_utterance(utterance),
+        'context': history.turns[-context_messages:] if context_messages else None,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+class LLMResponseCache:
+    """Answers to utterances heard before, LRU-bounded and expiring after a TTL."""
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, ttl: float = LLM_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def cacheable(self, utterance: str) -> bool:
+        return 0 < len(utterance) <= LLM_CACHE_MAX_UTTERANCE_CHARS
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None:
+            response, expires_at = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                llm_cache_request('hit')
+                return response
+            del self._entries[key]
+
+        self.misses += 1
+        llm_cache_request('miss')
+        return None
+
+    def put(self, key: str, response: str):
+        if not response:
+            return
+        self._entries[key] = (response, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+llm_cache = LLMResponseCache() if LLM_CACHE_ENABLED else None
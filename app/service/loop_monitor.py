@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from .metrics import LOOP_LAG_QUANTILE_SECONDS, loop_blocked, loop_lag
+
+# Watch the serving event loop for lag and for callbacks that block it
+LOOP_MONITOR_ENABLED = os.getenv('LOOP_MONITOR_ENABLED', 'false').lower() == 'true'
+# How often the loop is sampled; lag is how late a sleep of this length wakes up
+LOOP_MONITOR_INTERVAL = float(os.getenv('LOOP_MONITOR_INTERVAL', '0.1'))
+# Hold the loop longer than this and the blocking code's stack is logged
+LOOP_MONITOR_BLOCK_THRESHOLD = float(os.getenv('LOOP_MONITOR_BLOCK_THRESHOLD', '0.1'))
+# Samples the percentile gauges are computed over (600 x 0.1 s = the last minute)
+LOOP_MONITOR_WINDOW = int(os.getenv('LOOP_MONITOR_WINDOW', '600'))
+
+LAG_QUANTILES = (0.5, 0.9, 0.99, 1.0)
+# Innermost frames logged for a blocked loop
+STACK_LIMIT = 20
+
+class LoopMonitor:
+    """Measures event loop lag and catches whatever is blocking the loop.
+
+    A task on the loop sleeps `interval` at a time and records how late it
+    wakes up. A watchdog thread checks that task's heartbeat; when the loop
+    has been stuck past `threshold`, it logs the loop thread's current stack,
+    which is the code holding the loop, once per stall.
+    """
+
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, threshold: float = LOOP_MONITOR_BLOCK_THRESHOLD,
+                 window: int = LOOP_MONITOR_WINDOW):
+        self.interval = interval
+        self.threshold = threshold
+        self.samples = deque(maxlen=window)
+        self.heartbeat = time.monotonic()
+        self.blocks = 0
+        self._loop_thread = None
+        self._sampler = None
+        self._watchdog = None
+        self._stop = threading.Event()
+        for q in LAG_QUANTILES:
+            LOOP_LAG_QUANTILE_SECONDS.labels(str(q)).set_function(lambda q=q: self.lag_quantile(q))
+
+    async def start(self):
+        self._loop_thread = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self._sampler = asyncio.create_task(self._sample())
+        self._watchdog = threading.Thread(target=self._watch, name='loop-monitor', daemon=True)
+        self._watchdog.start()
+
+    async def close(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.cancel()
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+
+    def lag_quantile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    async def _sample(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self.heartbeat = now
+            self.samples.append(lag)
+            loop_lag(lag)
+
+    def _watch(self):
+        """Runs in its own thread, so it keeps running while the loop is stuck."""
+        reported = None
+        while not self._stop.wait(self.threshold / 2):
+            heartbeat = self.heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled < self.threshold or heartbeat == reported:
+                continue
+
+            reported = heartbeat
+            self.blocks += 1
+            loop_blocked()
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = ''.join(traceback.format_stack(frame, limit=STACK_LIMIT)) if frame is not None else '(unavailable)\n'
+            logging.warning("Event loop blocked for %.0f ms so far, in:\n%s", stalled * 1000, stack.rstrip('\n'))
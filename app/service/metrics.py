@@ -0,0 +1,120 @@
+import time
+from collections import deque
+
+from prometheus_client import Counter, Gauge, Histogram
+
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 8.0, 13.0)
+
+# stt: end of the utterance's audio arriving from Twilio -> final transcript
+# llm / llm_first_sentence: request sent (or promoted speculation, at the final transcript) -> full answer / first streamed sentence
+# tts_first_byte / tts: audio requested -> first byte / last byte
+# first_audio: end of the utterance's audio -> first byte of the answer's audio
+TURN_STAGE_SECONDS = Histogram(
+    'turn_stage_seconds', 'Latency of each stage of a call turn', ['stage'], buckets=LATENCY_BUCKETS,
+)
+VENDOR_ERRORS = Counter('vendor_errors_total', 'Failed requests to upstream vendors', ['vendor'])
+CALL_SESSIONS_LIVE = Gauge('call_sessions_live', 'Call sessions currently held by this worker')
+CALL_SESSIONS_EVICTED = Counter('call_sessions_evicted_total', 'Call sessions removed from the registry', ['reason'])
+# promoted: answer reused for the final transcript; restarted: final differed; superseded: a newer interim won;
+# cached: the response cache answered the final transcript; abandoned: stream ended
+LLM_SPECULATIONS = Counter('llm_speculations_total', 'LLM requests started on interim transcripts', ['outcome'])
+BARGE_INS = Counter('barge_ins_total', 'Answers cut off because the caller started speaking')
+LLM_CACHE_REQUESTS = Counter('llm_cache_requests_total', 'LLM response cache lookups', ['result'])
+AUDIO_QUEUE_DEPTH_SECONDS = Gauge('audio_queue_depth_seconds', 'Audio waiting to be sent to STT, summed over calls')
+AUDIO_QUEUE_HIGH_WATER_SECONDS = Histogram(
+    'audio_queue_high_water_seconds', 'Most audio a call ever had waiting to be sent to STT', buckets=LATENCY_BUCKETS,
+)
+# kind: 'silence' or 'oldest' chunk dropped to make room
+AUDIO_DROPPED_SECONDS = Counter('audio_dropped_seconds_total', 'Audio dropped because STT fell behind', ['kind'])
+AUDIO_OVERFLOW_DISCONNECTS = Counter('audio_overflow_disconnects_total', 'Media streams closed because STT fell behind')
+ADMISSION_QUEUED = Gauge('admission_queued', 'Upstream requests waiting for an admission slot', ['vendor'])
+ADMISSION_WAIT_SECONDS = Histogram(
+    'admission_wait_seconds', 'Time upstream requests waited for an admission slot', ['vendor'], buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_RETRIES = Counter('upstream_retries_total', 'Upstream requests retried after a 429 or 5xx', ['vendor'])
+TTS_PREFETCH_REQUESTS = Counter('tts_prefetch_requests_total', 'Audio requests by whether prefetched audio was waiting', ['result'])
+ARCHIVE_BUFFERED_BYTES = Gauge('archive_buffered_bytes', 'Call audio buffered in memory waiting to be archived')
+ARCHIVE_WRITTEN_BYTES = Counter('archive_written_bytes_total', 'Call audio written to the archive (before compression)')
+ARCHIVE_DROPPED_BYTES = Counter('archive_dropped_bytes_total', 'Call audio not archived because the archive buffer was full')
+LOOP_LAG_SECONDS = Histogram(
+    'event_loop_lag_seconds', 'How late the event loop ran a sleeping task',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_LAG_QUANTILE_SECONDS = Gauge('event_loop_lag_quantile_seconds', 'Event loop lag percentiles over the recent window', ['quantile'])
+LOOP_BLOCKS = Counter('event_loop_blocks_total', 'Times a callback held the event loop past the blocking threshold')
+
+def observe_stage(stage: str, started_at: float, finished_at: float = None):
+    TURN_STAGE_SECONDS.labels(stage).observe((finished_at or time.monotonic()) - started_at)
+
+def vendor_error(vendor: str):
+    VENDOR_ERRORS.labels(vendor).inc()
+
+def llm_speculation(outcome: str):
+    LLM_SPECULATIONS.labels(outcome).inc()
+
+def barge_in():
+    BARGE_INS.inc()
+
+def llm_cache_request(result: str):
+    LLM_CACHE_REQUESTS.labels(result).inc()
+
+def audio_dropped(kind: str, seconds: float):
+    AUDIO_DROPPED_SECONDS.labels(kind).inc(seconds)
+
+def audio_queue_closed(high_water_seconds: float):
+    AUDIO_QUEUE_HIGH_WATER_SECONDS.observe(high_water_seconds)
+
+def audio_overflow_disconnect():
+    AUDIO_OVERFLOW_DISCONNECTS.inc()
+
+def admission_wait(vendor: str, enqueued_at: float):
+    ADMISSION_WAIT_SECONDS.labels(vendor).observe(time.monotonic() - enqueued_at)
+
+def upstream_retry(vendor: str):
+    UPSTREAM_RETRIES.labels(vendor).inc()
+
+def tts_prefetch_request(result: str):
+    TTS_PREFETCH_REQUESTS.labels(result).inc()
+
+def archive_written(size: int):
+    ARCHIVE_WRITTEN_BYTES.inc(size)
+
+def archive_dropped(size: int):
+    ARCHIVE_DROPPED_BYTES.inc(size)
+
+def loop_lag(seconds: float):
+    LOOP_LAG_SECONDS.observe(seconds)
+
+def loop_blocked():
+    LOOP_BLOCKS.inc()
+
+class AudioClock:
+    """Maps offsets in the audio sent to STT back to when that audio arrived from Twilio."""
+
+    __slots__ = ('sent_ms', '_marks')
+
+    def __init__(self, horizon: int = 600):
+        self.sent_ms = 0.0
+        self._marks = deque(maxlen=horizon)
+
+    def mark(self, size: int, arrived_at: float):
+        self.sent_ms += size / 8  # 8 kHz, one byte per μ-law sample
+        self._marks.append((self.sent_ms, arrived_at))
+
+    def arrival_of(self, offset_ms: float):
+        while self._marks and self._marks[0][0] < offset_ms:
+            self._marks.popleft()
+        return self._marks[0][1] if self._marks else None
+
+async def measure_audio_stream(chunks, started_at: float, turn_started_at: float = None):
+    """Pass audio through, recording time to first byte and to completion."""
+    first = True
+    async for chunk in chunks:
+        if first:
+            first = False
+            now = time.monotonic()
+            observe_stage('tts_first_byte', started_at, now)
+            if turn_started_at is not None:
+                observe_stage('first_audio', turn_started_at, now)
+        yield chunk
+    observe_stage('tts', started_at)
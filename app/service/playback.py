@@ -0,0 +1,133 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+from typing import AsyncIterator
+
+from fastapi import WebSocket
+
+from .admission import current_call_sid
+from .archive import TTS_ULAW_TRACK
+from .llama import STREAMING_RESPONSE_MARKER
+from .metrics import barge_in, measure_audio_stream
+from .tts import elevenlabs_request, tts_stream_generator, tts_sentence_stream_generator
+
+# 'redirect' plays answers with <Play> and the /twiml/continue long-poll;
+# 'media_stream' sends them back as μ-law frames on the bidirectional /stream websocket
+PLAYBACK_MODE = os.getenv('PLAYBACK_MODE', 'redirect')
+# Audio per outbound media message; smaller frames make a barge-in `clear` cut in sooner
+PLAYBACK_FRAME_MS = int(os.getenv('PLAYBACK_FRAME_MS', '100'))
+
+# What a Twilio media stream carries: 8 kHz μ-law, one byte per sample
+PLAYBACK_OUTPUT_FORMAT = 'ulaw_8000'
+
+class MediaStreamPlayer:
+    """Plays audio to the caller over the Twilio media-stream websocket.
+
+    Each answer ends with a `mark`; Twilio echoes it once the caller has
+    heard everything before it, so until then the assistant is speaking.
+    `clear` drops whatever Twilio still has buffered.
+    """
+
+    def __init__(self, websocket: WebSocket, frame_ms: int = PLAYBACK_FRAME_MS):
+        self.websocket = websocket
+        self.frame_bytes = 8 * frame_ms
+        self.call_sid = None
+        self.stream_sid = None
+        self.started = asyncio.Event()
+        self.playing = None
+        self.pending_marks = set()
+        self._marks = 0
+        self._send_lock = asyncio.Lock()
+
+    def attach(self, call_sid: str, stream_sid: str):
+        self.call_sid = call_sid
+        self.stream_sid = stream_sid
+        self.started.set()
+
+    def on_mark(self, name: str):
+        self.pending_marks.discard(name)
+
+    @property
+    def speaking(self) -> bool:
+        return (self.playing is not None and not self.playing.done()) or bool(self.pending_marks)
+
+    async def _send(self, message: dict):
+        text = json.dumps(message, separators=(',', ':'))
+        async with self._send_lock:
+            await self.websocket.send_text(text)
+
+    async def _send_media(self, frame: bytes):
+        await self._send({
+            'event': 'media',
+            'streamSid': self.stream_sid,
+            'media': {'payload': base64.b64encode(frame).decode('ascii')},
+        })
+
+    async def play(self, audio: AsyncIterator[bytes]):
+        """Send `audio` and wait until it is sent or cut off by `clear`."""
+        self.playing = playing = asyncio.create_task(self._play(audio))
+        await asyncio.wait({playing})
+        if not playing.cancelled() and playing.exception() is not None:
+            raise playing.exception()
+
+    async def _play(self, audio: AsyncIterator[bytes]):
+        pending = bytearray()
+        async for chunk in audio:
+            pending += chunk
+            while len(pending) >= self.frame_bytes:
+                await self._send_media(bytes(pending[:self.frame_bytes]))
+                del pending[:self.frame_bytes]
+        if pending:
+            await self._send_media(bytes(pending))
+
+        self._marks += 1
+        name = f'answer-{self._marks}'
+        self.pending_marks.add(name)
+        await self._send({'event': 'mark', 'streamSid': self.stream_sid, 'mark': {'name': name}})
+
+    async def clear(self):
+        """Barge-in: stop sending and drop the audio Twilio has not played yet."""
+        if not self.speaking:
+            return
+        if self.playing is not None:
+            self.playing.cancel()
+        self.pending_marks.clear()
+        barge_in()
+        await self._send({'event': 'clear', 'streamSid': self.stream_sid})
+
+async def play_responses(player: MediaStreamPlayer, websocket: WebSocket):
+    """Media-stream counterpart of /twiml/continue and /elevenlabs/stream: speak each answer as it is ready."""
+    await player.started.wait()
+    call_sid = player.call_sid
+    current_call_sid.set(call_sid)
+    state = websocket.app.state.call_state
+    session = websocket.app.state.session
+    call = websocket.app.state.calls.create(call_sid)
+    archiver = websocket.app.state.archiver
+    cache = websocket.app.state.tts_cache
+
+    while True:
+        response = await state.pop_response(call_sid)
+        if response == 'END_TRANSCRIPT_MARKER':
+            break
+
+        started_at = time.monotonic()
+        sentences = await state.take_sentences(call_sid) if response == STREAMING_RESPONSE_MARKER else None
+        if sentences is not None:
+            voice_id, headers, payload = elevenlabs_request('')
+            audio = tts_sentence_stream_generator(session, voice_id, headers, payload, sentences, PLAYBACK_OUTPUT_FORMAT, cache)
+        else:
+            if response == STREAMING_RESPONSE_MARKER:
+                response = await state.get_transcript(call_sid)
+            voice_id, headers, payload = elevenlabs_request(response)
+            audio = tts_stream_generator(session, voice_id, headers, payload, PLAYBACK_OUTPUT_FORMAT, cache)
+        if archiver is not None:
+            audio = archiver.record(audio, call_sid, TTS_ULAW_TRACK)
+
+        try:
+            await player.play(measure_audio_stream(audio, started_at, call.turn_started_at))
+        except Exception as e:
+            logging.error(f"Error while playing response over the media stream: {str(e)}")
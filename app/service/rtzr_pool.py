@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from aiohttp import ClientSession, ClientWebSocketResponse
+
+from .auth import RtzrTokenManager
+from .stt import open_rtzr_ws
+
+RTZR_POOL_MAX_SIZE = int(os.getenv('RTZR_POOL_MAX_SIZE', '4'))
+# Idle sessions kept open at all times; 0 only opens them speculatively at /twiml/start
+RTZR_POOL_MIN_IDLE = int(os.getenv('RTZR_POOL_MIN_IDLE', '0'))
+# Return Zero drops streams that carry no audio for long, so idle sessions are recycled early
+RTZR_POOL_IDLE_TIMEOUT = float(os.getenv('RTZR_POOL_IDLE_TIMEOUT', '10'))
+
+class RtzrConnectionPool:
+    """Pre-opened Return Zero streaming sessions, handed out one per call.
+
+    A session is used by exactly one call and never returned; the pool only
+    moves the websocket handshake off the start of the call.
+    """
+
+    def __init__(self, session: ClientSession, token_manager: RtzrTokenManager, max_size: int = RTZR_POOL_MAX_SIZE,
+                 min_idle: int = RTZR_POOL_MIN_IDLE, idle_timeout: float = RTZR_POOL_IDLE_TIMEOUT):
+        self.session = session
+        self.token_manager = token_manager
+        self.max_size = max_size
+        self.min_idle = min(min_idle, max_size)
+        self.idle_timeout = idle_timeout
+        self._idle = deque()
+        self._opening = 0
+        self._tasks = set()
+        self._maintainer = None
+
+    async def start(self):
+        self._maintainer = asyncio.create_task(self._maintain())
+
+    async def close(self):
+        if self._maintainer is not None:
+            self._maintainer.cancel()
+        for task in self._tasks:
+            task.cancel()
+        while self._idle:
+            rtzr_ws, _ = self._idle.popleft()
+            await rtzr_ws.close()
+
+    async def acquire(self) -> ClientWebSocketResponse:
+        """Take a healthy pre-opened session, or open one if none is ready."""
+        now = asyncio.get_running_loop().time()
+        while self._idle:
+            # Newest first: it has the most time left before the idle timeout
+            rtzr_ws, opened_at = self._idle.pop()
+            if not rtzr_ws.closed and now - opened_at < self.idle_timeout:
+                logging.info("Using pre-opened Returnzero WebSocket")
+                return rtzr_ws
+            await rtzr_ws.close()
+
+        return await open_rtzr_ws(self.session, await self.token_manager.get_token())
+
+    def prewarm(self, count: int = 1):
+        """Speculatively open sessions in the background, within the pool cap."""
+        count = min(count, self.max_size - len(self._idle) - self._opening)
+        for _ in range(count):
+            self._opening += 1
+            task = asyncio.create_task(self._open())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _open(self):
+        try:
+            rtzr_ws = await open_rtzr_ws(self.session, await self.token_manager.get_token())
+        except Exception as e:
+            logging.warning(f"Failed to pre-open Returnzero WebSocket: {str(e)}")
+            return
+        finally:
+            self._opening -= 1
+        self._idle.append((rtzr_ws, asyncio.get_running_loop().time()))
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(1)
+            now = asyncio.get_running_loop().time()
+            while self._idle and (self._idle[0][0].closed or now - self._idle[0][1] >= self.idle_timeout):
+                rtzr_ws, _ = self._idle.popleft()
+                await rtzr_ws.close()
+            if len(self._idle) + self._opening < self.min_idle:
+                self.prewarm(self.min_idle - len(self._idle) - self._opening)
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import os
+import time
+
+from .metrics import CALL_SESSIONS_LIVE, CALL_SESSIONS_EVICTED
+
+# Calls with no activity for this long are evicted even without a Twilio `stop`
+CALL_SESSION_IDLE_TTL = float(os.getenv('CALL_SESSION_IDLE_TTL', '1800'))
+CALL_SESSION_SWEEP_INTERVAL = float(os.getenv('CALL_SESSION_SWEEP_INTERVAL', '30'))
+
+class CallSession:
+    """Everything the workers keep for one call, in a single compact object."""
+
+    __slots__ = ('call_sid', 'response_queue', 'sentence_queue', 'history', 'transcript', 'created_at', 'last_seen', 'turn_started_at')
+
+    def __init__(self, call_sid: str):
+        self.call_sid = call_sid
+        self.response_queue = asyncio.Queue()
+        self.sentence_queue = None
+        self.history = None
+        self.transcript = ''  # Text the next /elevenlabs/stream request speaks
+        self.created_at = self.last_seen = time.monotonic()
+        self.turn_started_at = None  # When the audio ending the caller's last utterance arrived
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+class CallSessionRegistry:
+    """Live calls by CallSid, evicted on Twilio `stop`, disconnect or idle TTL."""
+
+    def __init__(self, idle_ttl: float = CALL_SESSION_IDLE_TTL, sweep_interval: float = CALL_SESSION_SWEEP_INTERVAL):
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self._sessions = {}
+        self.evicted = {'stop': 0, 'disconnect': 0, 'overflow': 0, 'error': 0, 'idle': 0}
+        self._sweeper = None
+        CALL_SESSIONS_LIVE.set_function(lambda: len(self._sessions))
+
+    async def start(self):
+        self._sweeper = asyncio.create_task(self._sweep())
+
+    async def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+        self._sessions.clear()
+
+    def create(self, call_sid: str) -> CallSession:
+        session = self._sessions.get(call_sid)
+        if session is None:
+            session = self._sessions[call_sid] = CallSession(call_sid)
+        session.touch()
+        return session
+
+    def get(self, call_sid: str):
+        session = self._sessions.get(call_sid)
+        if session is not None:
+            session.touch()
+        return session
+
+    def evict(self, call_sid: str, reason: str) -> bool:
+        if self._sessions.pop(call_sid, None) is None:
+            return False
+        self.evicted[reason] += 1
+        CALL_SESSIONS_EVICTED.labels(reason).inc()
+        return True
+
+    def stats(self) -> dict:
+        return {'live': len(self._sessions), 'evicted': dict(self.evicted)}
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            deadline = time.monotonic() - self.idle_ttl
+            expired = [call_sid for call_sid, session in self._sessions.items() if session.last_seen < deadline]
+            for call_sid in expired:
+                self.evict(call_sid, 'idle')
+            if expired:
+                logging.info("Evicted %d idle call sessions: %s", len(expired), self.stats())
@@ -0,0 +1,109 @@
+import asyncio
+import difflib
+import logging
+import os
+import time
+from typing import AsyncIterator
+
+from fastapi import Request
+
+from .llama import call_chatgpt, get_history, stream_chatgpt
+from .llm_cache import normalize_utterance
+from .metrics import llm_speculation
+from .session import CallSession
+
+# Start the LLM request on a stable interim transcript instead of waiting for the final one
+LLM_SPECULATIVE = os.getenv('LLM_SPECULATIVE', 'false').lower() == 'true'
+# Identical interim hypotheses in a row, held for at least SPECULATIVE_STABLE_MS, before one counts as stable.
+# The hold time keeps word-by-word interim prefixes from each starting a request
+SPECULATIVE_STABLE_INTERIMS = int(os.getenv('SPECULATIVE_STABLE_INTERIMS', '2'))
+SPECULATIVE_STABLE_MS = float(os.getenv('SPECULATIVE_STABLE_MS', '300'))
+# Speculative requests started per caller turn at most; each one superseded is still billed
+SPECULATIVE_MAX_PER_TURN = int(os.getenv('SPECULATIVE_MAX_PER_TURN', '2'))
+SPECULATIVE_MIN_CHARS = int(os.getenv('SPECULATIVE_MIN_CHARS', '8'))
+# How similar (0-1) the final transcript must be to the speculated one to keep its answer
+SPECULATIVE_MATCH_THRESHOLD = float(os.getenv('SPECULATIVE_MATCH_THRESHOLD', '0.9'))
+
+def transcript_similarity(a: str, b: str) -> float:
+    return difflib.SequenceMatcher(None, normalize_utterance(a), normalize_utterance(b)).ratio()
+
+class InterimTracker:
+    """Picks the interim hypotheses worth speculating on: unchanged for a while, a few per turn at most."""
+
+    def __init__(self, stable_after: int = SPECULATIVE_STABLE_INTERIMS, min_chars: int = SPECULATIVE_MIN_CHARS,
+                 stable_ms: float = SPECULATIVE_STABLE_MS, max_per_turn: int = SPECULATIVE_MAX_PER_TURN):
+        self.stable_after = stable_after
+        self.min_chars = min_chars
+        self.stable_ms = stable_ms
+        self.max_per_turn = max_per_turn
+        self.reset()
+
+    def reset(self):
+        """A new caller turn: forget the hypothesis and the speculations started."""
+        self.last = ''
+        self.repeats = 0
+        self.since = None
+        self.picked = False
+        self.started = 0
+
+    def update(self, text: str, now: float = None):
+        now = time.monotonic() if now is None else now
+        normalized = normalize_utterance(text)
+        if normalized == self.last:
+            self.repeats += 1
+        else:
+            self.last = normalized
+            self.repeats = 1
+            self.since = now
+            self.picked = False
+
+        if (self.picked or self.started >= self.max_per_turn or self.repeats < self.stable_after
+                or (now - self.since) * 1000 < self.stable_ms or len(normalized) < self.min_chars):
+            return None
+        self.picked = True
+        self.started += 1
+        return text
+
+class Speculation:
+    """An LLM request started on an interim transcript.
+
+    Nothing is published or committed to the history until the final
+    transcript promotes it; a streamed completion is buffered meanwhile.
+    """
+
+    def __init__(self, call: CallSession, prompt: str, request: Request, streaming: bool):
+        self.prompt = prompt
+        self.started_at = time.monotonic()
+        history = get_history(call)
+        if streaming:
+            self.sentences = asyncio.Queue()
+            self.task = asyncio.create_task(self._buffer(stream_chatgpt(prompt, request, history)))
+        else:
+            self.sentences = None
+            self.task = asyncio.create_task(call_chatgpt(prompt, request, history))
+        logging.info('Speculating on interim transcript: %s', prompt)
+
+    async def _buffer(self, sentences: AsyncIterator[str]):
+        try:
+            async for sentence in sentences:
+                self.sentences.put_nowait(sentence)
+        finally:
+            self.sentences.put_nowait(None)
+
+    def matches(self, transcript: str, threshold: float = SPECULATIVE_MATCH_THRESHOLD) -> bool:
+        return transcript_similarity(self.prompt, transcript) >= threshold
+
+    def cancel(self, outcome: str):
+        self.task.cancel()
+        llm_speculation(outcome)
+
+    async def response(self) -> str:
+        llm_speculation('promoted')
+        return await self.task
+
+    async def stream(self) -> AsyncIterator[str]:
+        llm_speculation('promoted')
+        while (sentence := await self.sentences.get()) is not None:
+            yield sentence
+        # Surface an error the buffering task ended with
+        await self.task
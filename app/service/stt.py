@@ -1,12 +1,28 @@
 import asyncio
-import base64
 import json
 import logging
+import os
+import time
 
 from aiohttp import ClientSession, ClientWebSocketResponse, WSMsgType
 from fastapi import WebSocket, WebSocketDisconnect, Request
 
-from .llama import get_chatgpt_response
+from .admission import current_call_sid
+from .archive import INBOUND_TRACK
+from .audio_buffer import AudioCoalescer, AudioOverflow, AudioQueue
+from .metrics import AudioClock, audio_overflow_disconnect, observe_stage, vendor_error
+from .twilio_events import parse_twilio_event
+from .llama import LLM_STREAMING, assistant_text, get_chatgpt_response, stream_chatgpt_response
+from .speculation import LLM_SPECULATIVE, InterimTracker, Speculation
+from .tts import elevenlabs_request, tts_stream_generator
+
+RTZR_STREAMING_URL = os.getenv('RTZR_STREAMING_URL', 'wss://openapi.vito.ai/v1/transcribe:streaming')
+
+# Seconds to wait for Return Zero's last results after EOS before giving up on them
+RTZR_DRAIN_TIMEOUT = float(os.getenv('RTZR_DRAIN_TIMEOUT', '10'))
+
+# Voice-activity gating of inbound audio (see vad.py); numpy is only imported when enabled
+VAD_ENABLED = os.getenv('VAD_ENABLED', 'false').lower() == 'true'
 
 async def open_rtzr_ws(session: ClientSession, token: str) -> ClientWebSocketResponse:
     print("open_rtzr_ws1")
@@ -19,54 +35,134 @@ async def open_rtzr_ws(session: ClientSession, token: str) -> ClientWebSocketRes
     }
     config_str = "&".join(f"{key}={value}" for key, value in config.items())
     print("open_rtzr_ws2")
-    STREAMING_ENDPOINT = f"wss://openapi.vito.ai/v1/transcribe:streaming?{config_str}"
+    STREAMING_ENDPOINT = f"{RTZR_STREAMING_URL}?{config_str}"
 
     headers = {"Authorization": f"Bearer {token}"}
 
-    rtzr_ws = await session.ws_connect(STREAMING_ENDPOINT, headers=headers)
+    try:
+        rtzr_ws = await session.ws_connect(STREAMING_ENDPOINT, headers=headers)
+    except Exception:
+        vendor_error('returnzero')
+        raise
     print("open_rtzr_ws3")
 
     return rtzr_ws
 
-async def handle_twilio_messages(call_sid_queue: asyncio.Queue, audio_queue: asyncio.Queue, twilio_ws: WebSocket):
+async def handle_twilio_messages(call_sid_queue: asyncio.Queue, audio_queue: AudioQueue, twilio_ws: WebSocket, coalescer: AudioCoalescer, player=None):
+    """Feed the call's audio to STT until the stream ends; returns the CallSid and why it ended.
+
+    The call is not evicted here: Return Zero still sends the last results
+    (and the end marker) after this, see `end_call`.
+    """
+    archiver = twilio_ws.app.state.archiver
+    call_sid = None
+    reason = None
+    vad_gate = None
+    if VAD_ENABLED:
+        from .vad import VoiceActivityGate
+        vad_gate = VoiceActivityGate()
+
     while True:
         try:
-            print("handle_twilio_messages1")
-
             message = await twilio_ws.receive_text()
-            data = json.loads(message)
+            event, data = parse_twilio_event(message)
+
+            if event == 'media':
+                for chunk in coalescer.write(data):
+                    if archiver is not None:
+                        archiver.tap(call_sid, INBOUND_TRACK, chunk)
+                    enqueue_audio(audio_queue, coalescer, vad_gate, chunk)
 
-            if data['event'] == 'start':
+            elif event == 'start':
                 assert data['start']['mediaFormat']['encoding'] == 'audio/x-mulaw'
                 assert data['start']['mediaFormat']['sampleRate'] == 8000
                 call_sid = data['start']['callSid']
                 call_sid_queue.put_nowait(call_sid)
+                if player is not None:
+                    player.attach(call_sid, data['start']['streamSid'])
 
-            elif data['event'] == 'media':
-                chunk = base64.b64decode(data['media']['payload'])
-                audio_queue.put_nowait(chunk)
+            elif event == 'mark':
+                if player is not None:
+                    player.on_mark(data['mark']['name'])
 
-            elif data['event'] == 'stop':
+            elif event == 'stop':
+                reason = 'stop'
                 break
         except WebSocketDisconnect:
             logging.info("Twilio WebSocket disconnected")
+            reason = 'disconnect'
+            break
+        except AudioOverflow as e:
+            # AUDIO_QUEUE_POLICY=disconnect: a call this far behind is no longer worth keeping up
+            logging.warning(f"Closing Twilio media stream, STT is not keeping up: {str(e)}")
+            audio_overflow_disconnect()
+            reason = 'overflow'
+            await twilio_ws.close(code=1013)
             break
         except Exception as e:
             logging.error(f"Error in Twilio message handling: {str(e)}")
+            reason = 'error'
             break
 
-async def stream_audio_to_rtzr(audio_queue: asyncio.Queue, rtzr_ws: ClientWebSocketResponse):
+    chunk = coalescer.flush()
+    if chunk is not None:
+        if archiver is not None:
+            archiver.tap(call_sid, INBOUND_TRACK, chunk)
+        try:
+            enqueue_audio(audio_queue, coalescer, vad_gate, chunk)
+        except AudioOverflow:
+            pass
+    audio_queue.put_nowait("EOS")
+
+    if vad_gate is not None:
+        logging.info("VAD forwarded %d of %d frames", vad_gate.frames_out, vad_gate.frames_in)
+    return call_sid, reason
+
+async def end_call(twilio_ws: WebSocket, call_sid: str, reason: str):
+    """Evict the call once its media stream and STT results are both done."""
+    twilio_ws.app.state.calls.evict(call_sid, reason)
+    await twilio_ws.app.state.call_state.evict(call_sid)
+    prefetch = twilio_ws.app.state.tts_prefetch
+    if prefetch is not None:
+        prefetch.release(call_sid)
+    archiver = twilio_ws.app.state.archiver
+    if archiver is not None:
+        archiver.finish(call_sid)
+
+def enqueue_audio(audio_queue: AudioQueue, coalescer: AudioCoalescer, vad_gate, chunk: memoryview):
+    if vad_gate is not None:
+        gated = vad_gate.process(chunk)
+        coalescer.release(chunk)
+        if gated:
+            audio_queue.put_nowait(gated, time.monotonic())
+        return
+
+    audio_queue.put_nowait(chunk, time.monotonic())
+
+async def stream_audio_to_rtzr(audio_queue: AudioQueue, rtzr_ws: ClientWebSocketResponse, coalescer: AudioCoalescer, clock: AudioClock):
     print("stream_audio_to_rtzr")
     logging.info("Starting to stream audio to Returnzero WebSocket")
 
     while True:
-        chunk = await audio_queue.get()
+        chunk, arrived_at = await audio_queue.get()
+        if not isinstance(chunk, str):
+            # Marked when sent, so audio dropped from the queue never shifts Return Zero's offsets
+            clock.mark(len(chunk), arrived_at)
 
-        if chunk == "EOS":
+        if isinstance(chunk, memoryview):
+            try:
+                await rtzr_ws.send_bytes(chunk)
+            except Exception as e:
+                logging.error(f"Error sending audio chunk to Returnzero WebSocket: {str(e)}")
+                break
+            finally:
+                coalescer.release(chunk)
+
+        elif chunk == "EOS":
             await rtzr_ws.send_str("EOS")
             break
 
-        if isinstance(chunk, bytes):
+        elif isinstance(chunk, bytes):
             try:
                 await rtzr_ws.send_bytes(chunk)
             except Exception as e:
@@ -76,37 +172,77 @@ async def stream_audio_to_rtzr(audio_queue: asyncio.Queue, rtzr_ws: ClientWebSoc
             logging.warning('Unsupported message type from Twilio stream: %s', type(chunk))
             continue
 
-    logging.info("Finished streaming audio, closing Returnzero WebSocket")
-    await rtzr_ws.close()
+    # Return Zero sends the last final result and closes the socket after EOS
+    logging.info("Finished streaming audio to Returnzero WebSocket")
 
-async def handle_rtzr_messages(call_sid_queue: asyncio.Queue, rtzr_ws: ClientWebSocketResponse, request: Request):
+async def handle_rtzr_messages(call_sid_queue: asyncio.Queue, rtzr_ws: ClientWebSocketResponse, request: Request, clock: AudioClock, player=None):
     call_sid = await call_sid_queue.get()
-    response_queue = request.app.state.response_queues.get(call_sid)
-    if not isinstance(response_queue, asyncio.Queue):
-        logging.error(f"response_queue for call_sid {call_sid} is not a Queue. Got: {type(response_queue)}")
-        return
+    current_call_sid.set(call_sid)  # LLM and TTS requests started from here queue under this call
+    # The conversation lives on the worker holding the media stream, whichever one served /twiml/start
+    call = request.app.state.calls.create(call_sid)
+    state = request.app.state.call_state
+    interims = InterimTracker() if LLM_SPECULATIVE else None
+    speculation = None
+
+    try:
+        while True:
+            try:
+                message = await rtzr_ws.receive()  # Receive a message from the WebSocket
+
+                if message.type == WSMsgType.TEXT:
+                    msg = json.loads(message.data)
+                    # Barge-in: the caller talking over an answer cuts it off
+                    if player is not None and msg.get('alternatives') and msg['alternatives'][0]['text']:
+                        await player.clear()
+                    if 'final' in msg and msg['final'] == True:
+                        transcript = msg['alternatives'][0]['text']
+                        logging.info('transcript: %s', transcript)
+                        # start_at/duration are offsets (ms) into the audio this stream was sent
+                        utterance_end = clock.arrival_of(msg.get('start_at', 0) + msg.get('duration', 0))
+                        if utterance_end is not None:
+                            observe_stage('stt', utterance_end)
+                            call.turn_started_at = utterance_end
+                        promoted, speculation = speculation, None
+                        if interims is not None:
+                            interims.reset()
+                        if promoted is not None and not (transcript and promoted.matches(transcript)):
+                            promoted.cancel('restarted')
+                            promoted = None
+                        if transcript and LLM_STREAMING:
+                            response = await stream_chatgpt_response(call, transcript, request, promoted)
+                            logging.info('response: %s', response)
+                        elif transcript:
+                            response = await get_chatgpt_response(call, transcript, request, promoted)
+                            logging.info('response: %s', response)
+                            prefetch = request.app.state.tts_prefetch
+                            if prefetch is not None and response:
+                                # Synthesis starts now rather than after Twilio's redirect and GET
+                                voice_id, headers, payload = elevenlabs_request(assistant_text(response))
+                                prefetch.start(call_sid, tts_stream_generator(request.app.state.session, voice_id, headers, payload, cache=request.app.state.tts_cache))
+                            elif prefetch is not None:
+                                # No audio for this turn: the next GET must not replay the previous answer
+                                prefetch.release(call_sid)
+                            await state.push_response(call_sid, response)
+                    elif interims is not None and msg.get('alternatives'):
+                        stable = interims.update(msg['alternatives'][0]['text'])
+                        if stable is not None and (speculation is None or not speculation.matches(stable)):
+                            if speculation is not None:
+                                speculation.cancel('superseded')
+                            speculation = Speculation(call, stable, request, LLM_STREAMING)
+                    else:
+                        logging.warning(f"Warning: {msg}")
+
+                elif message.type in (WSMsgType.CLOSE, WSMsgType.CLOSED, WSMsgType.ERROR):
+                    if message.type == WSMsgType.ERROR:
+                        vendor_error('returnzero')
+                    logging.info("Returnzero WebSocket closed.")
+                    break
 
-    while True:
-        try:
-            message = await rtzr_ws.receive()  # Receive a message from the WebSocket
-
-            if message.type == WSMsgType.TEXT:
-                msg = json.loads(message.data)
-                if 'final' in msg and msg['final'] == True:
-                    transcript = msg['alternatives'][0]['text']
-                    print(transcript)
-                    if transcript:
-                        response = await get_chatgpt_response(call_sid, transcript, request)
-                        print(f'response: {response}')
-                        response_queue.put_nowait(response)
-                else:
-                    logging.warning(f"Warning: {msg}")
-
-            elif message.type == WSMsgType.CLOSE:
-                logging.info("Returnzero WebSocket closed.")
-                response_queue.put_nowait('END_TRANSCRIPT_MARKER')
+            except Exception as e:
+                logging.error(f"Error while receiving message from Returnzero WebSocket: {str(e)}")
                 break
-
-        except Exception as e:
-            logging.error(f"Error while receiving message from Returnzero WebSocket: {str(e)}")
-            break
\ No newline at end of file
+    finally:
+        if speculation is not None:
+            speculation.cancel('abandoned')
+        # Always sent, even after an error or a drain timeout: a /twiml/continue waiting for the next answer ends the call on it
+        await state.push_response(call_sid, 'END_TRANSCRIPT_MARKER')
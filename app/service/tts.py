@@ -1,20 +1,130 @@
+import asyncio
+import itertools
+import logging
+import os
+from typing import AsyncIterator
+
 from aiohttp import ClientSession
 
-async def tts_stream_generator(voice_id: str, headers: dict, payload: dict):
-    async with ClientSession() as session:
-        try:
-            async with session.post(
-                f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream",
-                headers=headers,
-                json=payload
-            ) as response:
-                if response.status != 200:
-                    raise Exception(f"Failed to stream TTS from ElevenLabs. Status: {response.status}")
-
-                async for chunk in response.content.iter_chunked(1024):
-                    if not chunk:
-                        break
-                    yield chunk
+from .. import ELEVENLABS_VOICE_ID
+from .admission import admitted, backoff, should_retry
+from .metrics import vendor_error
+from .tts_cache import TTSCache, tts_cache_key, iter_cached_chunks, TTS_CHUNK_SIZE
+
+ELEVENLABS_TTS_URL = os.getenv('ELEVENLABS_TTS_URL', 'https://api.elevenlabs.io/v1/text-to-speech')
+
+# Sentences synthesized ahead of the one currently being played
+TTS_SENTENCE_LOOKAHEAD = int(os.getenv('TTS_SENTENCE_LOOKAHEAD', '1'))
+
+def elevenlabs_request(text: str) -> tuple[str, dict, dict]:
+    """Voice, headers and payload of a TTS request for `text`."""
+    elevenlabs_api_key = os.getenv('ELEVENLABS_API_KEY')
+
+    headers = {
+        "xi-api-key": elevenlabs_api_key,
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "text": text,
+        "model_id": "eleven_multilingual_v2",
+        "voice_settings": {
+            "stability": 0.1,
+            "similarity_boost": 0.3,
+            "style": 0.2,
+        }
+    }
+
+    # voice_id = 'pMsXgVXv3BLzUgSXRplE' # default 목소리
+    return ELEVENLABS_VOICE_ID, headers, payload
+
+async def tts_stream_generator(session: ClientSession, voice_id: str, headers: dict, payload: dict, output_format: str = None, cache: TTSCache = None):
+    if cache is None or not cache.cacheable(payload):
+        async for chunk in elevenlabs_stream_generator(session, voice_id, headers, payload, output_format):
+            yield chunk
+        return
+
+    key = tts_cache_key(voice_id, payload, output_format)
+    audio = await cache.get(key)
+    if audio is not None:
+        for chunk in iter_cached_chunks(audio):
+            yield chunk
+        return
 
+    chunks = []
+    async for chunk in elevenlabs_stream_generator(session, voice_id, headers, payload, output_format):
+        chunks.append(chunk)
+        yield chunk
+    # Only complete responses get here; an aborted or failed stream is never cached
+    cache.put(key, b''.join(chunks))
+
+async def elevenlabs_stream_generator(session: ClientSession, voice_id: str, headers: dict, payload: dict, output_format: str = None):
+    # None keeps the ElevenLabs default (MP3); 'ulaw_8000' is what a Twilio media stream plays
+    params = {'output_format': output_format} if output_format else None
+    try:
+        for attempt in itertools.count():
+            # The slot is held until the whole audio is streamed: ElevenLabs limits concurrent requests
+            async with admitted('elevenlabs'):
+                async with session.post(
+                    f"{ELEVENLABS_TTS_URL}/{voice_id}/stream",
+                    headers=headers,
+                    params=params,
+                    json=payload
+                ) as response:
+                    if response.status == 200:
+                        async for chunk in response.content.iter_chunked(TTS_CHUNK_SIZE):
+                            if not chunk:
+                                break
+                            yield chunk
+                        return
+                    status, retry_after = response.status, response.headers.get('Retry-After')
+            if not should_retry(status, attempt):
+                raise Exception(f"Failed to stream TTS from ElevenLabs. Status: {status}")
+            vendor_error('elevenlabs')
+            await backoff('elevenlabs', attempt, retry_after)
+
+    except Exception as e:
+        vendor_error('elevenlabs')
+        raise Exception(f"Error while streaming TTS from ElevenLabs: {str(e)}")
+
+async def tts_sentence_stream_generator(session: ClientSession, voice_id: str, headers: dict, payload: dict, sentences: AsyncIterator[str], output_format: str = None, cache: TTSCache = None):
+    """Stream TTS for sentences as they arrive from `sentences`.
+
+    Synthesis of the next sentence starts while the current one is still
+    being played, so there is no gap between sentences.
+    """
+    audio_queues = asyncio.Queue(maxsize=TTS_SENTENCE_LOOKAHEAD)
+    tasks = set()
+
+    async def synthesize(sentence: str, audio_queue: asyncio.Queue):
+        try:
+            async for chunk in tts_stream_generator(session, voice_id, headers, {**payload, 'text': sentence}, output_format, cache):
+                audio_queue.put_nowait(chunk)
         except Exception as e:
-            raise Exception(f"Error while streaming TTS from ElevenLabs: {str(e)}")
\ No newline at end of file
+            logging.error(f"Error synthesizing sentence: {str(e)}")
+        finally:
+            audio_queue.put_nowait(None)
+
+    async def schedule():
+        async for sentence in sentences:
+            audio_queue = asyncio.Queue()
+            await audio_queues.put(audio_queue)
+            task = asyncio.create_task(synthesize(sentence, audio_queue))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await audio_queues.put(None)
+
+    scheduler = asyncio.create_task(schedule())
+    try:
+        while True:
+            audio_queue = await audio_queues.get()
+            if audio_queue is None:
+                break
+            while True:
+                chunk = await audio_queue.get()
+                if chunk is None:
+                    break
+                yield chunk
+    finally:
+        scheduler.cancel()
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import unicodedata
+from collections import OrderedDict
+
+TTS_CACHE_ENABLED = os.getenv('TTS_CACHE_ENABLED', 'false').lower() == 'true'
+TTS_CACHE_MEMORY_BYTES = int(os.getenv('TTS_CACHE_MEMORY_BYTES', str(32 * 1024 * 1024)))
+TTS_CACHE_DISK_BYTES = int(os.getenv('TTS_CACHE_DISK_BYTES', str(512 * 1024 * 1024)))
+TTS_CACHE_DIR = os.getenv('TTS_CACHE_DIR', '/tmp/tts-cache')
+# Long LLM answers are practically never repeated; only short phrases are worth keeping
+TTS_CACHE_MAX_TEXT_CHARS = int(os.getenv('TTS_CACHE_MAX_TEXT_CHARS', '200'))
+
+# Same chunk size as a live ElevenLabs response
+TTS_CHUNK_SIZE = 1024
+
+def normalize_text(text: str) -> str:
+    return unicodedata.normalize('NFC', ' '.join(text.split()))
+
+def tts_cache_key(voice_id: str, payload: dict, output_format: str = None) -> str:
+    key = {
+        'voice_id': voice_id,
+        'output_format': output_format,
+        'model_id': payload.get('model_id'),
+        'voice_settings': payload.get('voice_settings'),
+        'text': normalize_text(payload.get('text', '')),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+class TTSCache:
+    """Content-addressed TTS audio with an in-memory LRU tier that spills to disk.
+
+    Disk entries are read through mmap, so a disk hit is served without
+    copying the file into the heap. Every file operation runs in a thread:
+    entries evicted from memory are handed to a background task that writes
+    them out one at a time, and are still served from memory until then.
+    """
+
+    def __init__(self, directory: str = TTS_CACHE_DIR, memory_bytes: int = TTS_CACHE_MEMORY_BYTES, disk_bytes: int = TTS_CACHE_DISK_BYTES):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._spilling = OrderedDict()
+        self._spiller = None
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def start(self):
+        if not self.directory:
+            return
+        for _, key, size in sorted(await asyncio.to_thread(self._scan)):
+            self._disk[key] = size
+            self._disk_size += size
+
+    async def close(self):
+        # Entries already evicted from memory are still written out
+        if self._spiller is not None:
+            await self._spiller
+
+    def cacheable(self, payload: dict) -> bool:
+        return len(payload.get('text', '')) <= TTS_CACHE_MAX_TEXT_CHARS
+
+    async def get(self, key: str):
+        """Return the cached audio as a bytes-like object, or None."""
+        audio = self._memory.get(key)
+        if audio is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return audio
+
+        audio = self._spilling.get(key)
+        if audio is not None:
+            self.hits += 1
+            return audio
+
+        if key in self._disk:
+            try:
+                audio = await asyncio.to_thread(self._open, key)
+            except (OSError, ValueError):
+                self._forget_disk(key)
+                await asyncio.to_thread(self._remove, key)
+            else:
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self.hits += 1
+                return audio
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, audio: bytes):
+        if not audio or len(audio) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = audio
+        self._memory_size += len(audio)
+
+        while self._memory_size > self.memory_bytes:
+            evicted_key, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+            if self.directory and evicted_key not in self._disk:
+                self._spilling[evicted_key] = evicted
+
+        if self._spilling and (self._spiller is None or self._spiller.done()):
+            self._spiller = asyncio.create_task(self._spill())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.mp3')
+
+    def _scan(self) -> list:
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.mp3') and os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        return entries
+
+    def _open(self, key: str):
+        with open(self._path(key), 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    async def _spill(self):
+        while self._spilling:
+            key, audio = next(iter(self._spilling.items()))
+            try:
+                await asyncio.to_thread(self._write, key, audio)
+            except OSError as e:
+                logging.warning(f"Failed to spill TTS audio to disk: {str(e)}")
+                del self._spilling[key]
+                continue
+            del self._spilling[key]
+            self._disk[key] = len(audio)
+            self._disk_size += len(audio)
+
+            while self._disk_size > self.disk_bytes:
+                stale = next(iter(self._disk))
+                self._forget_disk(stale)
+                # Removed before the next write, so a re-spill of the same key is never deleted
+                await asyncio.to_thread(self._remove, stale)
+
+    def _write(self, key: str, audio: bytes):
+        path = self._path(key)
+        with open(f'{path}.tmp', 'wb') as f:
+            f.write(audio)
+        os.replace(f'{path}.tmp', path)
+
+    def _remove(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _forget_disk(self, key: str):
+        self._disk_size -= self._disk.pop(key, 0)
+
+def iter_cached_chunks(audio):
+    view = memoryview(audio)
+    try:
+        for start in range(0, len(view), TTS_CHUNK_SIZE):
+            yield bytes(view[start:start + TTS_CHUNK_SIZE])
+    finally:
+        view.release()
+        if isinstance(audio, mmap.mmap):
+            audio.close()
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import re
+from typing import AsyncIterator
+
+from .archive import TTS_MP3_TRACK
+from .metrics import tts_prefetch_request
+
+# Start TTS as soon as the answer is known instead of when Twilio fetches the audio.
+# The buffer lives in this process, so the /elevenlabs/stream request has to reach the
+# worker holding the call's media stream: prefetch is only used with CALL_STATE_BACKEND=memory.
+TTS_PREFETCH_ENABLED = os.getenv('TTS_PREFETCH_ENABLED', 'false').lower() == 'true'
+# How long finished audio is kept for a Range/retry request after it was played
+TTS_PREFETCH_RETAIN_SECONDS = float(os.getenv('TTS_PREFETCH_RETAIN_SECONDS', '10'))
+
+RANGE_HEADER = re.compile(r'bytes=(\d*)-(\d*)$')
+
+class AudioFanout:
+    """Audio that is still being synthesized, readable from any offset by any number of readers."""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+        self.done = False
+        self.error = None
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def write(self, chunk: bytes):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self._wake()
+
+    def finish(self, error: Exception = None):
+        self.done = True
+        self.error = error
+        self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def read(self, start: int = 0, end: int = None) -> AsyncIterator[bytes]:
+        """Replay what is buffered from `start`, then follow the live stream up to `end` (exclusive)."""
+        index = 0
+        position = 0
+        while True:
+            while index < len(self.chunks):
+                chunk = self.chunks[index]
+                index += 1
+                chunk_start, position = position, position + len(chunk)
+                if position <= start:
+                    continue
+                if end is not None and chunk_start >= end:
+                    return
+                yield chunk[max(0, start - chunk_start):len(chunk) if end is None else end - chunk_start]
+
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+    def byte_range(self, header: str):
+        """(start, end) of a satisfiable single `Range: bytes=` request on the finished audio, else None."""
+        match = RANGE_HEADER.match(header or '')
+        if not match or not self.done or self.error is not None or not self.size:
+            return None
+        first, last = match.groups()
+        if first:
+            start, end = int(first), int(last) + 1 if last else self.size
+        elif last:
+            start, end = max(0, self.size - int(last)), self.size
+        else:
+            return None
+        end = min(end, self.size)
+        return (start, end) if start < end else None
+
+class TTSPrefetcher:
+    """The current answer's audio of every call on this worker, synthesized ahead of the GET."""
+
+    def __init__(self, retain: float = TTS_PREFETCH_RETAIN_SECONDS, archiver=None):
+        self.retain = retain
+        self.archiver = archiver
+        self._buffers = {}
+
+    async def close(self):
+        for call_sid in list(self._buffers):
+            self.release(call_sid)
+
+    def start(self, call_sid: str, audio: AsyncIterator[bytes]) -> AudioFanout:
+        self.release(call_sid)
+        buffer = self._buffers[call_sid] = AudioFanout()
+        if self.archiver is not None:
+            # Archived once as it is synthesized, however many times it is read
+            audio = self.archiver.record(audio, call_sid, TTS_MP3_TRACK)
+        buffer.task = asyncio.create_task(self._fill(buffer, audio))
+        return buffer
+
+    async def _fill(self, buffer: AudioFanout, audio: AsyncIterator[bytes]):
+        error = None
+        try:
+            async for chunk in audio:
+                buffer.write(chunk)
+        except asyncio.CancelledError:
+            error = ConnectionAbortedError('TTS prefetch cancelled')
+            raise
+        except Exception as e:
+            logging.error(f"Error while prefetching TTS: {str(e)}")
+            error = e
+        finally:
+            # Readers must never be left waiting on a buffer nobody writes to
+            buffer.finish(error)
+
+    def get(self, call_sid: str):
+        buffer = self._buffers.get(call_sid)
+        tts_prefetch_request('hit' if buffer is not None else 'miss')
+        return buffer
+
+    async def stream(self, call_sid: str, buffer: AudioFanout, start: int = 0, end: int = None) -> AsyncIterator[bytes]:
+        async for chunk in buffer.read(start, end):
+            yield chunk
+        # Played through; keep it a little longer for a retry, then free it
+        asyncio.get_running_loop().call_later(self.retain, self._expire, call_sid, buffer)
+
+    def _expire(self, call_sid: str, buffer: AudioFanout):
+        if self._buffers.get(call_sid) is buffer:
+            self.release(call_sid)
+
+    def release(self, call_sid: str):
+        buffer = self._buffers.pop(call_sid, None)
+        if buffer is not None and not buffer.task.done():
+            buffer.task.cancel()
+
+def create_tts_prefetcher(playback_mode: str, call_state_backend: str, archiver=None):
+    if not TTS_PREFETCH_ENABLED or playback_mode != 'redirect':
+        return None  # media_stream mode plays answers straight over the websocket
+    if call_state_backend != 'memory':
+        # The buffer would claim the shared sentence stream on the media worker, leaving an
+        # /elevenlabs/stream request served by another worker with only the previous answer
+        logging.warning("TTS_PREFETCH_ENABLED is ignored with CALL_STATE_BACKEND=%s", call_state_backend)
+        return None
+    return TTSPrefetcher(archiver=archiver)
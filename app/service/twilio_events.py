@@ -0,0 +1,33 @@
+import json
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Twilio serializes media events with a fixed key order, starting with the event name
+MEDIA_PREFIX = '{"event":"media"'
+PAYLOAD_KEY = '"payload":"'
+
+def parse_twilio_event(message: str) -> tuple:
+    """Parse a Twilio media-stream message into (event, data).
+
+    For `media` events `data` is just the base64 payload, sliced out of the
+    raw text without building a dict. Anything else, or a media message
+    that does not look the way Twilio normally writes it, is fully
+    decoded and returned as a dict.
+    """
+    if message.startswith(MEDIA_PREFIX):
+        start = message.find(PAYLOAD_KEY, len(MEDIA_PREFIX))
+        if start != -1:
+            start += len(PAYLOAD_KEY)
+            end = message.find('"', start)
+            # base64 never needs JSON escapes; a backslash means an unusual encoder
+            if end != -1 and message.find('\\', start, end) == -1:
+                return 'media', message[start:end]
+
+    data = _loads(message)
+    if data.get('event') == 'media':
+        return 'media', data['media']['payload']
+    return data.get('event'), data
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import os
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+UPSTREAM_LIMIT = int(os.getenv('UPSTREAM_LIMIT', '200'))
+UPSTREAM_LIMIT_PER_HOST = int(os.getenv('UPSTREAM_LIMIT_PER_HOST', '50'))
+UPSTREAM_DNS_TTL = int(os.getenv('UPSTREAM_DNS_TTL', '300'))
+# Long-lived streaming websockets (one Return Zero stream per call) hold a connection for the whole call;
+# they get their own connector so they never use up the request/response limits above. 0 = no limit
+UPSTREAM_STREAM_LIMIT = int(os.getenv('UPSTREAM_STREAM_LIMIT', '0'))
+UPSTREAM_KEEPALIVE_TIMEOUT = float(os.getenv('UPSTREAM_KEEPALIVE_TIMEOUT', '60'))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '5'))
+# Longest silence between two reads of a response. No total timeout, so long streamed answers and audio are fine,
+# but a vendor that stops sending fails the request instead of holding the turn (and its admission slot) forever
+UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', '30'))
+# Connections opened per host at startup so the first calls skip the TCP/TLS handshake
+UPSTREAM_WARM_CONNECTIONS = int(os.getenv('UPSTREAM_WARM_CONNECTIONS', '2'))
+
+UPSTREAM_HOSTS = os.getenv('UPSTREAM_HOSTS', 'https://api.openai.com,https://api.elevenlabs.io,https://openapi.vito.ai').split(',')
+
+def create_upstream_session() -> ClientSession:
+    """Shared keep-alive session for vendor request/response traffic (OpenAI, ElevenLabs, Return Zero auth)."""
+    connector = TCPConnector(
+        limit=UPSTREAM_LIMIT,
+        limit_per_host=UPSTREAM_LIMIT_PER_HOST,
+        use_dns_cache=True,
+        ttl_dns_cache=UPSTREAM_DNS_TTL,
+        keepalive_timeout=UPSTREAM_KEEPALIVE_TIMEOUT,
+    )
+    timeout = ClientTimeout(total=None, connect=UPSTREAM_CONNECT_TIMEOUT, sock_read=UPSTREAM_READ_TIMEOUT)
+
+    return ClientSession(connector=connector, timeout=timeout)
+
+def create_stream_session() -> ClientSession:
+    """Session for per-call streaming websockets, kept apart from the request/response pool."""
+    connector = TCPConnector(
+        limit=UPSTREAM_STREAM_LIMIT,
+        use_dns_cache=True,
+        ttl_dns_cache=UPSTREAM_DNS_TTL,
+    )
+    timeout = ClientTimeout(total=None, connect=UPSTREAM_CONNECT_TIMEOUT)
+
+    return ClientSession(connector=connector, timeout=timeout)
+
+async def warm_upstream_connections(session: ClientSession, hosts: list = UPSTREAM_HOSTS, connections: int = UPSTREAM_WARM_CONNECTIONS):
+    """Resolve DNS and park idle keep-alive connections in the pool for each host."""
+    async def warm(url: str):
+        try:
+            async with session.head(url, allow_redirects=False) as resp:
+                await resp.read()
+        except Exception as e:
+            logging.warning(f"Failed to warm upstream connection to {url}: {str(e)}")
+
+    await asyncio.gather(*(warm(url) for url in hosts for _ in range(connections)))
+    logging.info("Warmed %d upstream connections per host", connections)
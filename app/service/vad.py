@@ -0,0 +1,96 @@
+import os
+from collections import deque
+
+import numpy as np
+
+# RMS of 16-bit linear PCM above which a frame counts as speech
+VAD_ENERGY_THRESHOLD = float(os.getenv('VAD_ENERGY_THRESHOLD', '400'))
+# Quieter frames still count as speech when they cross zero this often (fricatives)
+VAD_ZCR_THRESHOLD = float(os.getenv('VAD_ZCR_THRESHOLD', '0.35'))
+# Silence forwarded after speech so Return Zero can still detect the end of the utterance
+VAD_HANGOVER_MS = int(os.getenv('VAD_HANGOVER_MS', '600'))
+# Silence held back and sent in front of speech so onsets are not clipped
+VAD_PREROLL_MS = int(os.getenv('VAD_PREROLL_MS', '100'))
+# During long silences, still forward one frame out of this many (0 drops them all)
+VAD_SILENCE_KEEP_EVERY = int(os.getenv('VAD_SILENCE_KEEP_EVERY', '25'))
+
+SAMPLE_RATE = 8000
+FRAME_MS = 20
+FRAME_BYTES = SAMPLE_RATE * FRAME_MS // 1000  # one byte per μ-law sample
+
+def _ulaw_to_pcm_table() -> np.ndarray:
+    ulaw = ~np.arange(256, dtype=np.uint8)
+    exponent = (ulaw >> 4) & 0x07
+    mantissa = (ulaw & 0x0F).astype(np.int32)
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(ulaw & 0x80, -magnitude, magnitude).astype(np.int16)
+
+ULAW_TO_PCM = _ulaw_to_pcm_table()
+
+def ulaw_to_pcm(chunk) -> np.ndarray:
+    return ULAW_TO_PCM[np.frombuffer(chunk, dtype=np.uint8)]
+
+class VoiceActivityGate:
+    """Drops or thins silent μ-law frames before they are sent to STT.
+
+    Frames are classified in batches: every 20 ms frame in a chunk is
+    decoded and scored in one vectorized pass.
+    """
+
+    def __init__(self, energy_threshold: float = VAD_ENERGY_THRESHOLD, zcr_threshold: float = VAD_ZCR_THRESHOLD,
+                 hangover_ms: int = VAD_HANGOVER_MS, preroll_ms: int = VAD_PREROLL_MS,
+                 silence_keep_every: int = VAD_SILENCE_KEEP_EVERY):
+        self.energy_threshold = energy_threshold
+        self.zcr_threshold = zcr_threshold
+        self.hangover_frames = hangover_ms // FRAME_MS
+        self.silence_keep_every = silence_keep_every
+        self._preroll = deque(maxlen=preroll_ms // FRAME_MS)
+        self._hangover = 0
+        self._silent_run = 0
+        self.frames_in = 0
+        self.frames_out = 0
+
+    def classify(self, chunk) -> np.ndarray:
+        """Return one speech/silence flag per whole frame in `chunk`."""
+        count = len(chunk) // FRAME_BYTES
+        samples = ulaw_to_pcm(memoryview(chunk)[:count * FRAME_BYTES]).reshape(count, FRAME_BYTES).astype(np.float32)
+
+        energy = np.sqrt(np.mean(samples * samples, axis=1))
+        zcr = np.mean(np.signbit(samples[:, 1:]) != np.signbit(samples[:, :-1]), axis=1)
+
+        return (energy >= self.energy_threshold) | ((energy >= self.energy_threshold / 2) & (zcr >= self.zcr_threshold))
+
+    def process(self, chunk) -> bytes:
+        """Return the part of `chunk` that should be forwarded (possibly empty)."""
+        count = len(chunk) // FRAME_BYTES
+        if count == 0:
+            return bytes(chunk)
+
+        view = memoryview(chunk)
+        forward = []
+        for index, speech in enumerate(self.classify(chunk)):
+            frame = view[index * FRAME_BYTES:(index + 1) * FRAME_BYTES]
+            if speech:
+                forward.extend(self._preroll)
+                self._preroll.clear()
+                forward.append(frame)
+                self._hangover = self.hangover_frames
+                self._silent_run = 0
+            elif self._hangover > 0:
+                self._hangover -= 1
+                forward.append(frame)
+            else:
+                self._silent_run += 1
+                if self.silence_keep_every and self._silent_run % self.silence_keep_every == 0:
+                    forward.append(frame)
+                elif self._preroll.maxlen:
+                    # Copied: the caller may reuse the chunk's buffer
+                    self._preroll.append(bytes(frame))
+
+        # A trailing partial frame is passed through untouched
+        if len(chunk) > count * FRAME_BYTES:
+            forward.append(view[count * FRAME_BYTES:])
+
+        self.frames_in += count
+        self.frames_out += sum(len(frame) for frame in forward) // FRAME_BYTES
+        return b''.join(forward)
@@ -0,0 +1,92 @@
+"""Standalone RabbitMQ consumer: `python -m app.worker [--processes N]`.
+
+Runs the learntoservingqueue consumer apart from the HTTP/websocket workers,
+so queue throughput and call capacity are sized independently. Start the API
+with RABBITMQ_CONSUMER_MODE=external next to it; every consumer process has
+its own broker connection, database pool and prefetch window.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+from app.router.consumer import RabbitMQConsumer
+from app.router.container import RabbitMQContainer
+from app.service.db import create_db_pool, ModelUpdateBatcher
+
+RABBITMQ_WORKER_PROCESSES = int(os.getenv('RABBITMQ_WORKER_PROCESSES', '1'))
+# Seconds a consumer gets to finish its batch after SIGTERM
+RABBITMQ_WORKER_STOP_TIMEOUT = float(os.getenv('RABBITMQ_WORKER_STOP_TIMEOUT', '10'))
+
+async def consume():
+    db_pool = await create_db_pool()
+    model_updates = ModelUpdateBatcher(db_pool)
+    connection = await RabbitMQContainer.connection()
+    consumer = RabbitMQConsumer(connection, model_updates)
+    await consumer.start()
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+
+    try:
+        await stopping.wait()
+    finally:
+        await consumer.stop()
+        await connection.close()
+        await db_pool.close()
+
+def run_consumer():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(levelname)s %(message)s')
+    asyncio.run(consume())
+
+def supervise(processes: int):
+    """Keep `processes` consumers running, restarting any that exit, until SIGTERM/SIGINT."""
+    context = multiprocessing.get_context('spawn')
+    children = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while not stopping:
+        for slot in range(processes):
+            child = children.get(slot)
+            if child is not None and child.is_alive():
+                continue
+            if child is not None:
+                logging.warning("Consumer %d exited with %s; restarting", slot, child.exitcode)
+            child = children[slot] = context.Process(target=run_consumer, name=f'rabbitmq-consumer-{slot}')
+            child.start()
+        time.sleep(1)
+
+    for child in children.values():
+        if child.is_alive():
+            child.terminate()
+    for child in children.values():
+        child.join(RABBITMQ_WORKER_STOP_TIMEOUT)
+        if child.is_alive():
+            child.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the RabbitMQ consumer outside the API workers.')
+    parser.add_argument('--processes', type=int, default=RABBITMQ_WORKER_PROCESSES,
+                        help='consumer processes to keep running (default: RABBITMQ_WORKER_PROCESSES)')
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_consumer()
+    else:
+        logging.basicConfig(level=logging.INFO)
+        supervise(args.processes)
+
+if __name__ == '__main__':
+    main()
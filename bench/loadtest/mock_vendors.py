@@ -0,0 +1,159 @@
+"""Local stand-ins for Return Zero, OpenAI and ElevenLabs with configurable latency.
+
+The Return Zero mock runs its own endpointer: audio that is not pure μ-law
+silence (0xFF) counts as speech, and a final result is sent `stt_latency`
+after the first silence that follows speech. Interim results grow word by
+word while the speech lasts.
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from dataclasses import dataclass
+
+from aiohttp import WSMsgType, web
+
+@dataclass
+class VendorLatency:
+    stt: float = 0.3
+    llm_first_token: float = 0.4
+    llm_token: float = 0.02
+    tts_first_byte: float = 0.25
+    tts_chunk: float = 0.01
+
+QUESTION = 'What are your opening hours?'
+ANSWER = 'Sure, I can help with that. Our office is open from nine to six on weekdays. Is there anything else?'
+TTS_BYTES = 24 * 1024
+TTS_CHUNK = 1024
+
+def interim_text(speech_ms: float) -> str:
+    # One more word of the question every 200 ms of speech, then the whole question repeated
+    words = QUESTION.split(' ')
+    return ' '.join(words[:int(speech_ms // 200) + 1])
+
+class MockVendors:
+    def __init__(self, latency: VendorLatency, throttle_rate: float = 0.0):
+        self.latency = latency
+        # Share of chat and TTS requests answered with 429, as a rate-limited vendor would
+        self.throttle_rate = throttle_rate
+        self.requests = {'authenticate': 0, 'transcribe': 0, 'chat': 0, 'tts': 0, 'throttled': 0}
+
+    def throttled(self) -> bool:
+        if random.random() >= self.throttle_rate:
+            return False
+        self.requests['throttled'] += 1
+        return True
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/v1/authenticate', self.authenticate)
+        app.router.add_get('/v1/transcribe:streaming', self.transcribe)
+        app.router.add_post('/v1/chat/completions', self.chat)
+        app.router.add_post('/v1/text-to-speech/{voice_id}/stream', self.tts)
+        # Connection warm-up probes
+        app.router.add_route('HEAD', '/', self.ok)
+        return app
+
+    async def ok(self, request: web.Request) -> web.Response:
+        return web.Response()
+
+    async def authenticate(self, request: web.Request) -> web.Response:
+        self.requests['authenticate'] += 1
+        return web.json_response({'access_token': 'mock-token', 'expire_at': int(time.time()) + 6 * 3600})
+
+    async def transcribe(self, request: web.Request) -> web.WebSocketResponse:
+        self.requests['transcribe'] += 1
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        offset_ms = 0.0
+        speech_start = speech_end = None
+        seq = 0
+        finals = set()
+
+        async def send_final(seq: int, start_ms: float, end_ms: float):
+            await asyncio.sleep(self.latency.stt)
+            if not ws.closed:
+                await ws.send_json({
+                    'seq': seq,
+                    'start_at': int(start_ms),
+                    'duration': int(end_ms - start_ms),
+                    'final': True,
+                    'alternatives': [{'text': f'{QUESTION} ({seq})'}],
+                })
+
+        def end_utterance():
+            nonlocal speech_start, seq
+            task = asyncio.create_task(send_final(seq, speech_start, speech_end))
+            finals.add(task)
+            task.add_done_callback(finals.discard)
+            speech_start = None
+            seq += 1
+
+        async for msg in ws:
+            if msg.type == WSMsgType.BINARY:
+                data = msg.data
+                speech = data.strip(b'\xff')
+                if speech:
+                    if speech_start is None:
+                        speech_start = offset_ms + (len(data) - len(data.lstrip(b'\xff'))) / 8
+                    speech_end = offset_ms + len(data.rstrip(b'\xff')) / 8
+                if speech_start is not None and data[-1] == 0xFF:
+                    end_utterance()
+                elif speech:
+                    await ws.send_json({'seq': seq, 'final': False, 'alternatives': [{'text': interim_text(speech_end - speech_start)}]})
+                offset_ms += len(data) / 8
+
+            elif msg.type == WSMsgType.TEXT and msg.data == 'EOS':
+                if speech_start is not None:
+                    end_utterance()
+                if finals:
+                    await asyncio.gather(*finals)
+                await ws.close()
+
+        return ws
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        self.requests['chat'] += 1
+        payload = await request.json()
+        if self.throttled():
+            return web.json_response({'error': {'type': 'rate_limit_exceeded'}}, status=429, headers={'Retry-After': '0.1'})
+        tokens = [word + ' ' for word in ANSWER.split(' ')]
+
+        await asyncio.sleep(self.latency.llm_first_token)
+
+        if not payload.get('stream'):
+            await asyncio.sleep(self.latency.llm_token * len(tokens))
+            return web.json_response({'choices': [{'message': {'role': 'assistant', 'content': ANSWER}}]})
+
+        resp = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        try:
+            await resp.prepare(request)
+            for token in tokens:
+                chunk = {'choices': [{'delta': {'content': token}}]}
+                await resp.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+                await asyncio.sleep(self.latency.llm_token)
+            await resp.write(b'data: [DONE]\n\n')
+            await resp.write_eof()
+        except ConnectionResetError:
+            # The app hung up, e.g. a cancelled speculative request
+            pass
+        return resp
+
+    async def tts(self, request: web.Request) -> web.StreamResponse:
+        self.requests['tts'] += 1
+        await request.read()
+        if self.throttled():
+            return web.json_response({'detail': {'status': 'too_many_concurrent_requests'}}, status=429)
+
+        await asyncio.sleep(self.latency.tts_first_byte)
+
+        resp = web.StreamResponse(headers={'Content-Type': 'audio/mpeg'})
+        await resp.prepare(request)
+        audio = os.urandom(TTS_BYTES)
+        for start in range(0, len(audio), TTS_CHUNK):
+            await resp.write(audio[start:start + TTS_CHUNK])
+            await asyncio.sleep(self.latency.tts_chunk)
+        await resp.write_eof()
+        return resp
@@ -0,0 +1,366 @@
+"""End-to-end load test: N simulated Twilio calls against one app worker.
+
+Starts the vendor mocks, launches `uvicorn app.main:app` pointed at them,
+and drives every call through /twiml/start, the media websocket, the
+/twiml/continue long-poll and the ElevenLabs stream endpoint.
+
+    python bench/loadtest/run.py --calls 50 --turns 3
+    python bench/loadtest/run.py --calls 100 --max-p99-ms 2500 --json result.json
+
+Turn latency is measured from the last speech frame the caller sent to
+the first byte of the answer's audio. The exit status is non-zero when a
+turn fails or a --max-* budget is exceeded, so it can gate regressions.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+import xml.etree.ElementTree as ElementTree
+
+from aiohttp import ClientSession, ClientTimeout, web
+
+from mock_vendors import MockVendors, VendorLatency
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+FRAME_MS = 20
+FRAME_BYTES = 160
+SILENCE = b'\xff' * FRAME_BYTES
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+class ProcessSampler:
+    """CPU time and resident memory of the app process, read from /proc."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.peak_rss = 0
+
+    def cpu_seconds(self) -> float:
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+    def rss(self) -> int:
+        with open(f'/proc/{self.pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) * 1024
+                    self.peak_rss = max(self.peak_rss, rss)
+                    return rss
+        return 0
+
+    async def watch(self, interval: float = 0.2):
+        while True:
+            self.rss()
+            await asyncio.sleep(interval)
+
+def stop_message(stream_sid: str, call_sid: str) -> str:
+    return json.dumps({'event': 'stop', 'streamSid': stream_sid, 'stop': {'callSid': call_sid}})
+
+def media_message(stream_sid: str, sequence: int, frame: bytes) -> str:
+    return json.dumps({
+        'event': 'media',
+        'sequenceNumber': str(sequence),
+        'media': {'track': 'inbound', 'chunk': str(sequence), 'timestamp': str(sequence * FRAME_MS),
+                  'payload': base64.b64encode(frame).decode('ascii')},
+        'streamSid': stream_sid,
+    }, separators=(',', ':'))
+
+def parse_twiml(text: str) -> tuple:
+    root = ElementTree.fromstring(text)
+    play = root.find('Play')
+    redirect = root.find('Redirect')
+    return (play.text if play is not None else None), (redirect.text if redirect is not None else None)
+
+async def abandoned_stream(http: ClientSession, base_url: str):
+    # A media websocket closed before Twilio's `start`; the app must still release its STT session
+    ws = await http.ws_connect(base_url.replace('http', 'ws', 1) + '/twilio/stream')
+    await ws.send_str(json.dumps({'event': 'connected', 'protocol': 'Call', 'version': '1.0.0'}))
+    await ws.close()
+
+async def simulate_call(http: ClientSession, base_url: str, args, latencies: list, failures: list):
+    call_sid = 'CA' + uuid.uuid4().hex
+    stream_sid = 'MZ' + uuid.uuid4().hex
+
+    async with http.post(f'{base_url}/twilio/twiml/start', data={'CallSid': call_sid}) as resp:
+        _, redirect = parse_twiml(await resp.text())
+
+    ws = await http.ws_connect(base_url.replace('http', 'ws', 1) + '/twilio/stream')
+    await ws.send_str(json.dumps({'event': 'connected', 'protocol': 'Call', 'version': '1.0.0'}))
+    await ws.send_str(json.dumps({
+        'event': 'start',
+        'start': {'callSid': call_sid, 'streamSid': stream_sid, 'tracks': ['inbound'],
+                  'mediaFormat': {'encoding': 'audio/x-mulaw', 'sampleRate': 8000, 'channels': 1}},
+        'streamSid': stream_sid,
+    }))
+
+    speech_frames_left = 0
+    speech_ends = asyncio.Queue()
+
+    async def send_media():
+        # Real-time pacing: one 20 ms frame per tick, speech while a turn is spoken, silence otherwise
+        nonlocal speech_frames_left
+        sequence = 0
+        next_tick = time.monotonic()
+        while True:
+            if speech_frames_left > 0:
+                frame = bytes(random.randrange(0, 0xFF) for _ in range(FRAME_BYTES))
+                speech_frames_left -= 1
+            else:
+                frame = SILENCE
+            await ws.send_str(media_message(stream_sid, sequence, frame))
+            if frame is not SILENCE and speech_frames_left == 0:
+                speech_ends.put_nowait(time.monotonic())
+            sequence += 1
+            next_tick += FRAME_MS / 1000
+            await asyncio.sleep(max(0, next_tick - time.monotonic()))
+
+    first_audio = asyncio.Queue()
+    answers_played = asyncio.Queue()
+
+    async def receive_playback():
+        # media_stream mode: answers come back as media frames, each followed by a mark to echo
+        first = True
+        async for msg in ws:
+            data = json.loads(msg.data)
+            if data['event'] == 'media' and first:
+                first_audio.put_nowait(time.monotonic())
+                first = False
+            elif data['event'] == 'mark':
+                await ws.send_str(json.dumps({'event': 'mark', 'streamSid': stream_sid, 'mark': data['mark']}))
+                answers_played.put_nowait(None)
+                first = True
+
+    sender = asyncio.create_task(send_media())
+    receiver = asyncio.create_task(receive_playback())
+    try:
+        for _ in range(args.turns):
+            if args.playback == 'media_stream':
+                speech_frames_left = args.utterance_ms // FRAME_MS
+                spoken_at = await speech_ends.get()
+                latencies.append(await first_audio.get() - spoken_at)
+                await answers_played.get()
+                await asyncio.sleep(args.think_ms / 1000)
+                continue
+
+            continue_request = asyncio.create_task(http.post(redirect, data={'CallSid': call_sid}))
+            speech_frames_left = args.utterance_ms // FRAME_MS
+
+            async with await continue_request as resp:
+                play, redirect = parse_twiml(await resp.text())
+            spoken_at = await speech_ends.get()
+            if play is None:
+                failures.append(f'{call_sid}: no <Play> in continue response')
+                break
+
+            # Twilio parses the TwiML and fetches the audio from its own network
+            await asyncio.sleep(args.twilio_rtt_ms / 1000)
+            async with http.get(play) as resp:
+                first = True
+                async for _ in resp.content.iter_any():
+                    if first:
+                        latencies.append(time.monotonic() - spoken_at)
+                        first = False
+                if first or resp.status != 200:
+                    failures.append(f'{call_sid}: no audio (status {resp.status})')
+
+            await asyncio.sleep(args.think_ms / 1000)
+
+        if args.playback == 'redirect':
+            # The caller hangs up while Twilio long-polls the next /continue; that request must still end the call
+            hangup_request = asyncio.create_task(http.post(redirect, data={'CallSid': call_sid}))
+            await asyncio.sleep(0.1)
+            await ws.send_str(stop_message(stream_sid, call_sid))
+            await ws.close()
+            async with await asyncio.wait_for(hangup_request, 10) as resp:
+                if 'Goodbye' not in await resp.text():
+                    failures.append(f'{call_sid}: no goodbye after hang-up')
+    except Exception as e:
+        failures.append(f'{call_sid}: {e!r}')
+    finally:
+        sender.cancel()
+        receiver.cancel()
+        if not ws.closed:
+            await ws.send_str(stop_message(stream_sid, call_sid))
+            await ws.close()
+
+async def stage_latencies(http: ClientSession, base_url: str) -> dict:
+    async with http.get(f'{base_url}/metrics') as resp:
+        text = await resp.text()
+    sums = dict(re.findall(r'turn_stage_seconds_sum\{stage="(\w+)"\} (\S+)', text))
+    counts = dict(re.findall(r'turn_stage_seconds_count\{stage="(\w+)"\} (\S+)', text))
+    return {stage: float(sums[stage]) / float(counts[stage]) * 1000 for stage in sums if float(counts.get(stage, 0))}
+
+async def run(args) -> dict:
+    vendors = MockVendors(VendorLatency(
+        stt=args.stt_latency_ms / 1000,
+        llm_first_token=args.llm_first_token_ms / 1000,
+        llm_token=args.llm_token_ms / 1000,
+        tts_first_byte=args.tts_first_byte_ms / 1000,
+        tts_chunk=args.tts_chunk_ms / 1000,
+    ), throttle_rate=args.throttle_rate)
+    runner = web.AppRunner(vendors.app())
+    await runner.setup()
+    mock_port = free_port()
+    await web.TCPSite(runner, '127.0.0.1', mock_port).start()
+    mock_url = f'http://127.0.0.1:{mock_port}'
+
+    env = dict(os.environ)
+    env.update({
+        'RETURNZERO_CLIENT_URL': f'{mock_url}/v1/authenticate',
+        'RTZR_STREAMING_URL': f'ws://127.0.0.1:{mock_port}/v1/transcribe:streaming',
+        'OPENAI_CHAT_URL': f'{mock_url}/v1/chat/completions',
+        'OPENAI_MODEL_ID': 'mock',
+        'OPENAI_API_KEY': 'mock',
+        'ELEVENLABS_API_KEY': 'mock',
+        'RETURNZERO_CLIENT_ID': 'mock',
+        'RETURNZERO_CLIENT_SECRET': 'mock',
+        'ELEVENLABS_TTS_URL': f'{mock_url}/v1/text-to-speech',
+        'ELEVENLABS_VOICE_ID': 'mock',
+        'UPSTREAM_HOSTS': mock_url,
+        'RABBITMQ_CONSUMER_MODE': 'external',
+        'PLAYBACK_MODE': args.playback,
+    })
+    for item in args.app_env:
+        key, _, value = item.partition('=')
+        env[key] = value
+
+    app_port = free_port()
+    base_url = f'http://127.0.0.1:{app_port}'
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.main:app', '--host', '127.0.0.1', '--port', str(app_port), '--log-level', 'warning'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL if args.quiet else None, stderr=subprocess.DEVNULL if args.quiet else None,
+    )
+
+    latencies, failures = [], []
+    try:
+        async with ClientSession(timeout=ClientTimeout(total=120)) as http:
+            for _ in range(100):
+                try:
+                    async with http.get(f'{base_url}/metrics') as resp:
+                        if resp.status == 200:
+                            break
+                except OSError:
+                    pass
+                await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError('app did not start')
+
+            sampler = ProcessSampler(server.pid)
+            baseline_rss = sampler.rss()
+            cpu_before = sampler.cpu_seconds()
+            watcher = asyncio.create_task(sampler.watch())
+            started = time.monotonic()
+
+            async def delayed_call(delay: float):
+                await asyncio.sleep(delay)
+                await simulate_call(http, base_url, args, latencies, failures)
+
+            await abandoned_stream(http, base_url)
+            await asyncio.gather(*(delayed_call(args.ramp_s * i / args.calls) for i in range(args.calls)))
+
+            elapsed = time.monotonic() - started
+            cpu = sampler.cpu_seconds() - cpu_before
+            watcher.cancel()
+            stages = await stage_latencies(http, base_url)
+    finally:
+        server.terminate()
+        try:
+            # A request or websocket handler that never finishes keeps uvicorn from shutting down
+            server.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+            failures.append('app did not shut down within 15 s of SIGTERM')
+        await runner.cleanup()
+
+    return {
+        'calls': args.calls,
+        'turns': len(latencies),
+        'failures': len(failures),
+        'failure_samples': failures[:5],
+        'turn_latency_ms': {
+            'p50': percentile(latencies, 50) * 1000 if latencies else None,
+            'p99': percentile(latencies, 99) * 1000 if latencies else None,
+            'mean': statistics.fmean(latencies) * 1000 if latencies else None,
+        },
+        'stage_mean_ms': stages,
+        'elapsed_s': elapsed,
+        'cpu_s': cpu,
+        'cpu_ms_per_call_second': cpu * 1000 / (args.calls * elapsed),
+        'rss_baseline_mb': baseline_rss / 2**20,
+        'rss_peak_mb': sampler.peak_rss / 2**20,
+        'rss_mb_per_call': (sampler.peak_rss - baseline_rss) / 2**20 / args.calls,
+        'vendor_requests': vendors.requests,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=20)
+    parser.add_argument('--turns', type=int, default=3)
+    parser.add_argument('--ramp-s', type=float, default=2.0, help='spread call starts over this many seconds')
+    parser.add_argument('--utterance-ms', type=int, default=1500)
+    parser.add_argument('--think-ms', type=int, default=500)
+    parser.add_argument('--stt-latency-ms', type=float, default=300)
+    parser.add_argument('--llm-first-token-ms', type=float, default=400)
+    parser.add_argument('--llm-token-ms', type=float, default=20)
+    parser.add_argument('--tts-first-byte-ms', type=float, default=250)
+    parser.add_argument('--tts-chunk-ms', type=float, default=10)
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='share of chat and TTS requests the mocks reject with 429')
+    parser.add_argument('--twilio-rtt-ms', type=float, default=0,
+                        help='delay between a continue response and the audio GET, as Twilio adds it')
+    parser.add_argument('--playback', choices=('redirect', 'media_stream'), default='redirect',
+                        help='PLAYBACK_MODE of the app: <Play> + continue loop, or audio over the media websocket')
+    parser.add_argument('--app-env', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra environment for the app, e.g. LLM_STREAMING=true')
+    parser.add_argument('--max-p50-ms', type=float)
+    parser.add_argument('--max-p99-ms', type=float)
+    parser.add_argument('--max-cpu-ms-per-call-second', type=float)
+    parser.add_argument('--max-rss-mb-per-call', type=float)
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--quiet', action='store_true', help='hide the app output')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    violations = []
+    if result['failures']:
+        violations.append(f"{result['failures']} failed turns")
+    budgets = (
+        ('max_p50_ms', result['turn_latency_ms']['p50']),
+        ('max_p99_ms', result['turn_latency_ms']['p99']),
+        ('max_cpu_ms_per_call_second', result['cpu_ms_per_call_second']),
+        ('max_rss_mb_per_call', result['rss_mb_per_call']),
+    )
+    for name, value in budgets:
+        limit = getattr(args, name)
+        if limit is not None and (value is None or value > limit):
+            violations.append(f'{name}: {value} > {limit}')
+
+    if violations:
+        print('FAILED: ' + '; '.join(violations), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
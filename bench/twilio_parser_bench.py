@@ -0,0 +1,58 @@
+"""Microbenchmark: Twilio media-stream message handling, stdlib path vs fast path.
+
+    python bench/twilio_parser_bench.py [--number 200000]
+"""
+import argparse
+import base64
+import binascii
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.service import twilio_events
+
+def media_message(sequence: int) -> str:
+    payload = base64.b64encode(os.urandom(160)).decode('ascii')
+    return json.dumps({
+        'event': 'media',
+        'sequenceNumber': str(sequence),
+        'media': {'track': 'inbound', 'chunk': str(sequence), 'timestamp': str(sequence * 20), 'payload': payload},
+        'streamSid': 'MZ18ad3ab5a668481ce02b83e7395059f0',
+    }, separators=(',', ':'))
+
+def stdlib_path(message: str):
+    data = json.loads(message)
+    if data['event'] == 'media':
+        return base64.b64decode(data['media']['payload'])
+
+def fast_path(message: str):
+    event, data = twilio_events.parse_twilio_event(message)
+    if event == 'media':
+        return binascii.a2b_base64(data)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=200000)
+    args = parser.parse_args()
+
+    messages = [media_message(i) for i in range(1000)]
+    assert all(stdlib_path(m) == fast_path(m) for m in messages)
+
+    def run(handler):
+        for message in messages:
+            handler(message)
+
+    loops = max(1, args.number // len(messages))
+    print(f'json backend: {twilio_events._loads.__module__}')
+    results = {}
+    for name, handler in (('stdlib', stdlib_path), ('fast', fast_path)):
+        seconds = min(timeit.repeat(lambda: run(handler), number=loops, repeat=5))
+        results[name] = seconds / (loops * len(messages)) * 1e9
+        print(f'{name:>7}: {results[name]:8.0f} ns/message')
+    print(f'speedup: {results["stdlib"] / results["fast"]:.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+from app.service.admission import VendorGate
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 10))
+
+def test_waiting_calls_are_served_round_robin():
+    async def scenario():
+        gate = VendorGate('test', rate=1000, burst=100, concurrency=1)
+        order = []
+
+        async def request(call_sid: str, name: str):
+            async with gate.slot(call_sid):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        async with gate.slot('CA0'):
+            # One call queues three requests before another call queues its first
+            tasks = [asyncio.create_task(request(call_sid, name))
+                     for call_sid, name in (('CA1', 'a1'), ('CA1', 'a2'), ('CA1', 'a3'), ('CA2', 'b1'))]
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert run(scenario()) == ['a1', 'b1', 'a2', 'a3']
+
+def test_grant_racing_a_cancel_is_handed_back():
+    async def scenario():
+        gate = VendorGate('test', rate=1000, burst=100, concurrency=1)
+        entered = []
+
+        async def request():
+            async with gate.slot('CA2'):
+                entered.append('CA2')
+
+        async with gate.slot('CA1'):
+            waiter = asyncio.create_task(request())
+            await asyncio.sleep(0)
+        # Leaving the slot granted it to the waiter, which is cancelled before it gets to run
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert waiter.cancelled()
+        assert entered == []
+        assert gate.active == 0
+
+        async with gate.slot('CA3'):
+            return gate.active
+
+    assert run(scenario()) == 1
+
+def test_token_bucket_spaces_requests_beyond_the_burst():
+    async def scenario():
+        gate = VendorGate('test', rate=20, burst=2, concurrency=10)
+        started_at = time.monotonic()
+        granted_at = []
+
+        async def request():
+            async with gate.slot('CA1'):
+                granted_at.append(time.monotonic() - started_at)
+
+        await asyncio.gather(*(request() for _ in range(4)))
+        return granted_at
+
+    granted_at = run(scenario())
+    # The burst goes out at once, then one token every 1 / rate seconds
+    assert granted_at[1] < 0.03
+    assert 0.04 <= granted_at[2] < 0.2
+    assert 0.09 <= granted_at[3] < 0.3
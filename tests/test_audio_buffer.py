@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from app.service.audio_buffer import AudioCoalescer, AudioOverflow, AudioQueue
+
+# μ-law: 0xFF is the quietest sample, 0x00 the loudest
+SILENT = bytes([0xFF]) * 40
+LOUD = bytes([0x00]) * 40
+
+def chunk(sample: bytes, tag: int) -> bytes:
+    # Distinct chunks with the same loudness, so the test can tell which were dropped
+    return sample[:-1] + bytes([sample[-1] ^ tag])
+
+def queued(queue: AudioQueue) -> list:
+    return [item for item, _ in queue._items]
+
+def audio_queue(policy: str) -> AudioQueue:
+    return AudioQueue(AudioCoalescer(flush_bytes=40), max_ms=10, policy=policy)  # Room for two chunks
+
+def test_drop_silence_drops_quiet_audio_before_the_oldest():
+    queue = audio_queue('drop_silence')
+    loud, silent, newer, newest = chunk(LOUD, 1), chunk(SILENT, 0), chunk(LOUD, 2), chunk(LOUD, 3)
+    queue.put_nowait(loud)
+    queue.put_nowait(silent)
+
+    queue.put_nowait(newer)
+    assert queued(queue) == [loud, newer]
+
+    # Nothing quiet left: the oldest goes
+    queue.put_nowait(newest)
+    assert queued(queue) == [newer, newest]
+    assert queue.bytes == 80
+    assert queue.dropped == 80
+
+def test_end_of_stream_is_never_dropped():
+    queue = audio_queue('drop_oldest')
+    first, second = chunk(LOUD, 1), chunk(LOUD, 2)
+    queue.put_nowait(first)
+    queue.put_nowait(second)
+    queue.put_nowait('EOS')
+
+    queue.put_nowait(chunk(LOUD, 3))
+    queue.put_nowait(chunk(LOUD, 4))
+    assert queued(queue)[0] == 'EOS'
+
+    # Dropping stops at the marker, even past the limit
+    queue.put_nowait(chunk(LOUD, 5))
+    assert queued(queue) == ['EOS', chunk(LOUD, 3), chunk(LOUD, 4), chunk(LOUD, 5)]
+
+    async def drain():
+        return [(await queue.get())[0] for _ in range(4)]
+
+    assert asyncio.run(drain())[0] == 'EOS'
+
+def test_disconnect_policy_raises_and_keeps_the_queue():
+    queue = audio_queue('disconnect')
+    queue.put_nowait(LOUD)
+    queue.put_nowait(LOUD)
+
+    with pytest.raises(AudioOverflow):
+        queue.put_nowait(LOUD)
+    assert queue.bytes == 80
+    assert queue.dropped == 0
+
+def test_dropped_segments_go_back_to_the_ring():
+    coalescer = AudioCoalescer(flush_bytes=30, segments=2)
+    queue = AudioQueue(coalescer, max_ms=4, policy='drop_oldest')  # Room for one segment
+    first = coalescer.write('AAAA' * 10)[0]
+    segment = first.obj
+    queue.put_nowait(first)
+    assert not any(free is segment for free in coalescer._free)
+
+    queue.put_nowait(coalescer.write('AAAA' * 10)[0])
+    assert any(free is segment for free in coalescer._free)
@@ -0,0 +1,101 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from app.service.call_state import RedisCallState
+
+def redis_state(main_connections: int = 10, blocking_connections: int = 50, poll_timeout: float = 0.1) -> RedisCallState:
+    # Two clients on one fake server, as from_url sets it up against a real one
+    server = fakeredis.FakeServer()
+    client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True, max_connections=main_connections)
+    blocking_client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True, max_connections=blocking_connections)
+    return RedisCallState(client, blocking_client, ttl=60, poll_timeout=poll_timeout)
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 10))
+
+def test_responses_reach_a_waiting_pop():
+    async def scenario():
+        state = redis_state()
+        await state.create('CA1')
+        waiting = asyncio.create_task(state.pop_response('CA1'))
+        await asyncio.sleep(0.3)  # Several poll timeouts
+        await state.push_response('CA1', 'hello')
+        return await waiting
+
+    assert run(scenario()) == 'hello'
+
+def test_end_marker_survives_eviction():
+    async def scenario():
+        state = redis_state()
+        await state.create('CA1')
+        await state.push_response('CA1', 'END_TRANSCRIPT_MARKER')
+        await state.evict('CA1')
+        return await state.pop_response('CA1')
+
+    assert run(scenario()) == 'END_TRANSCRIPT_MARKER'
+
+def test_pop_on_an_evicted_call_ends_it():
+    async def scenario():
+        state = redis_state()
+        await state.create('CA1')
+        waiting = asyncio.create_task(state.pop_response('CA1'))
+        await state.evict('CA1')
+        return await waiting
+
+    assert run(scenario()) == 'END_TRANSCRIPT_MARKER'
+
+def test_sentence_stream_is_claimed_once():
+    async def scenario():
+        state = redis_state()
+        await state.create('CA1')
+        writer = await state.start_sentences('CA1')
+        sentences = await state.take_sentences('CA1')
+        assert await state.take_sentences('CA1') is None
+
+        async def write():
+            for sentence in ('One.', 'Two.'):
+                await asyncio.sleep(0.15)
+                await writer.push(sentence)
+            await writer.end()
+
+        asyncio.create_task(write())
+        received = [sentence async for sentence in sentences]
+        assert not await state.client.exists('call:CA1:sentences:1')
+        return received
+
+    assert run(scenario()) == ['One.', 'Two.']
+
+@pytest.mark.parametrize('write', ['set_transcript', 'start_sentences'])
+def test_writes_after_eviction_keep_a_ttl(write):
+    async def scenario():
+        state = redis_state()
+        await state.create('CA1')
+        await state.evict('CA1')
+        if write == 'set_transcript':
+            await state.set_transcript('CA1', 'late answer')
+        else:
+            await state.start_sentences('CA1')
+        return await state.client.ttl('call:CA1')
+
+    assert 0 < run(scenario()) <= 60
+
+def test_waiting_calls_do_not_exhaust_the_main_pool():
+    async def scenario():
+        state = redis_state(main_connections=2)
+        calls = [f'CA{i}' for i in range(20)]
+        for call_sid in calls:
+            await state.create(call_sid)
+        waiting = [asyncio.create_task(state.pop_response(call_sid)) for call_sid in calls]
+        await asyncio.sleep(0.2)
+
+        # Everything else keeps working while 20 calls wait on a pool of 2
+        for call_sid in calls:
+            await state.set_transcript(call_sid, 'answer')
+            assert await state.get_transcript(call_sid) == 'answer'
+            await state.push_response(call_sid, call_sid)
+        return await asyncio.gather(*waiting), calls
+
+    responses, calls = run(scenario())
+    assert responses == calls
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from app.service import tts_prefetch
+from app.service.tts_prefetch import AudioFanout, create_tts_prefetcher
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 10))
+
+async def collect(audio) -> bytes:
+    return b''.join([chunk async for chunk in audio])
+
+def finished(*chunks: bytes) -> AudioFanout:
+    buffer = AudioFanout()
+    for chunk in chunks:
+        buffer.write(chunk)
+    buffer.finish()
+    return buffer
+
+def test_read_replays_then_follows_the_live_stream():
+    async def scenario():
+        buffer = AudioFanout()
+        buffer.write(b'abc')
+        early = asyncio.create_task(collect(buffer.read()))
+        await asyncio.sleep(0)
+        buffer.write(b'def')
+        late = asyncio.create_task(collect(buffer.read()))
+        await asyncio.sleep(0)
+        buffer.write(b'ghi')
+        buffer.finish()
+        return await early, await late
+
+    assert run(scenario()) == (b'abcdefghi', b'abcdefghi')
+
+@pytest.mark.parametrize('start, end, expected', [
+    (0, None, b'abcdefghi'),
+    (4, None, b'efghi'),
+    (3, 6, b'def'),
+    (2, 7, b'cdefg'),
+    (8, 9, b'i'),
+])
+def test_read_slices_across_chunks(start, end, expected):
+    buffer = finished(b'abc', b'def', b'ghi')
+    assert run(collect(buffer.read(start, end))) == expected
+
+def test_read_raises_the_synthesis_error():
+    async def scenario():
+        buffer = AudioFanout()
+        buffer.write(b'abc')
+        reader = asyncio.create_task(collect(buffer.read()))
+        await asyncio.sleep(0)
+        buffer.finish(ConnectionAbortedError('TTS prefetch cancelled'))
+        return await reader
+
+    with pytest.raises(ConnectionAbortedError):
+        run(scenario())
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-', (0, 9)),
+    ('bytes=2-5', (2, 6)),
+    ('bytes=4-100', (4, 9)),
+    ('bytes=-3', (6, 9)),
+    ('bytes=-100', (0, 9)),
+    ('bytes=9-', None),
+    ('bytes=-', None),
+    ('bytes=0-1,4-5', None),
+    ('items=0-1', None),
+    (None, None),
+])
+def test_byte_range(header, expected):
+    assert finished(b'abc', b'def', b'ghi').byte_range(header) == expected
+
+def test_byte_range_needs_the_complete_audio():
+    async def scenario():
+        streaming = AudioFanout()
+        streaming.write(b'abc')
+        failed = AudioFanout()
+        failed.write(b'abc')
+        failed.finish(ConnectionAbortedError())
+        return streaming.byte_range('bytes=0-1'), failed.byte_range('bytes=0-1'), finished().byte_range('bytes=0-')
+
+    assert run(scenario()) == (None, None, None)
+
+def test_prefetch_needs_the_in_process_call_state(monkeypatch):
+    monkeypatch.setattr(tts_prefetch, 'TTS_PREFETCH_ENABLED', True)
+    assert create_tts_prefetcher('redirect', 'memory') is not None
+    assert create_tts_prefetcher('redirect', 'redis') is None
+    assert create_tts_prefetcher('media_stream', 'memory') is None
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from app.service import twilio_events
+from app.service.twilio_events import parse_twilio_event
+
+PAYLOAD = 'f/7+/n5+fn5+/v7+fn5+fn7+/g=='
+
+def media_message(**fields) -> str:
+    media = {'track': 'inbound', 'chunk': '2', 'timestamp': '40', 'payload': PAYLOAD}
+    # Key order as Twilio writes it
+    return json.dumps({'event': 'media', 'sequenceNumber': '3', 'media': media, 'streamSid': 'MZ1', **fields}, separators=(',', ':'))
+
+@pytest.fixture
+def decoded(monkeypatch):
+    """Messages that went through the full JSON decode."""
+    messages = []
+
+    def loads(message):
+        messages.append(message)
+        return json.loads(message)
+
+    monkeypatch.setattr(twilio_events, '_loads', loads)
+    return messages
+
+def test_media_payload_is_sliced_without_decoding(decoded):
+    assert parse_twilio_event(media_message()) == ('media', PAYLOAD)
+    assert decoded == []
+
+@pytest.mark.parametrize('message', [
+    # Not the order Twilio uses
+    json.dumps({'media': {'payload': PAYLOAD}, 'event': 'media'}, separators=(',', ':')),
+    # Whitespace after the separators
+    json.dumps({'event': 'media', 'media': {'payload': PAYLOAD}}),
+    # An encoder that escapes '/'
+    media_message().replace('/', '\\/'),
+])
+def test_unusual_media_messages_fall_back_to_json(decoded, message):
+    assert parse_twilio_event(message) == ('media', PAYLOAD)
+    assert decoded == [message]
+
+@pytest.mark.parametrize('event', ['connected', 'start', 'mark', 'stop'])
+def test_other_events_are_decoded(decoded, event):
+    message = json.dumps({'event': event, 'streamSid': 'MZ1'})
+    assert parse_twilio_event(message) == (event, {'event': event, 'streamSid': 'MZ1'})
+    assert decoded == [message]
+
+def test_fast_path_matches_the_full_decode():
+    message = media_message()
+    assert parse_twilio_event(message)[1] == json.loads(message)['media']['payload']